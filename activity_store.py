@@ -0,0 +1,262 @@
+import csv
+import datetime
+import sqlite3
+from typing import Dict, List, Optional
+
+from tmetric_io import open_text, parse_day, parse_clock, parse_duration, row_tags
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    code TEXT,
+    client TEXT
+);
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    day INTEGER NOT NULL,          -- datetime.date.toordinal()
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    project_id INTEGER NOT NULL REFERENCES projects(id),
+    start_time INTEGER NOT NULL,   -- seconds since midnight
+    end_time INTEGER NOT NULL,     -- seconds since midnight
+    duration INTEGER NOT NULL,     -- seconds
+    entry TEXT,
+    work_type TEXT
+);
+CREATE TABLE IF NOT EXISTS activity_tags (
+    activity_id INTEGER NOT NULL REFERENCES activities(id),
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activities_day ON activities(day);
+CREATE INDEX IF NOT EXISTS idx_activities_user_day ON activities(user_id, day);
+CREATE INDEX IF NOT EXISTS idx_activities_project_day ON activities(project_id, day);
+CREATE INDEX IF NOT EXISTS idx_activity_tags_tag ON activity_tags(tag);
+"""
+
+# an activity is stored once, loading the same (or an overlapping) export again adds nothing. Repeated rows within
+# an export are stored once as well, as Work removes them (validation.DUPLICATE), so both give the same totals.
+# Databases created before this key existed are deduplicated when they are opened
+UNIQUE_KEY = """
+DELETE FROM activities WHERE id NOT IN (
+    SELECT MIN(id) FROM activities GROUP BY user_id, day, start_time, duration, project_id, entry);
+DELETE FROM activity_tags WHERE activity_id NOT IN (SELECT id FROM activities);
+CREATE UNIQUE INDEX idx_activities_unique ON activities(user_id, day, start_time, duration, project_id, entry);
+"""
+
+
+def _clock_str(seconds: int) -> str:
+    mm, ss = divmod(seconds, 60)
+    hh, mm = divmod(mm, 60)
+    return "%02d:%02d:%02d" % (hh, mm, ss)
+
+
+def _holidays(start_date: datetime.date, end_date: datetime.date, worked, exclude_weekend: bool) -> List[datetime.date]:
+    holidays = []
+    day = start_date
+    while day <= end_date:
+        if day not in worked and not (exclude_weekend and day.weekday() >= 5):
+            holidays.append(day)
+        day += datetime.timedelta(days=1)
+    return holidays
+
+
+class ActivityStore(object):
+    '''
+    persistent sqlite store of tmetric activities, aggregates are computed by (indexed) SQL queries
+    '''
+    def __init__(self, db_path: str) -> None:
+        '''
+        opens (and if necessary creates) the database
+        :param db_path: filename of the sqlite database, or ':memory:'
+        '''
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_activities_unique'").fetchone():
+            self.conn.executescript('BEGIN;' + UNIQUE_KEY + 'COMMIT;')
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _ids(self, table: str) -> Dict[str, int]:
+        return {name: row_id for row_id, name in self.conn.execute('SELECT id, name FROM {}'.format(table))}
+
+    def load_csv(self, filename: str) -> int:
+        '''
+        adds the activities of a tmetric CSV file to the store in a single transaction, activities that are already
+        stored (same user, day, start time, duration, project and time entry) are skipped
+        :param filename: name of csv file with tmetric data
+        :return: number of activities added
+        '''
+        with open_text(filename, encoding='utf-8-sig') as csvfile:
+            return self.load_rows(csv.DictReader(csvfile))
+
+    def load_rows(self, rows) -> int:
+        '''
+        adds tmetric rows (dicts as produced by csv.DictReader) to the store in a single transaction, skipping
+        activities that are already stored
+        :param rows: iterable of CSV rows
+        :return: number of activities added
+        '''
+        users = self._ids('users')
+        projects = self._ids('projects')
+        new_users = []
+        new_projects = []
+        activities = []
+        tags = []
+        next_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM activities').fetchone()[0]
+        for row in rows:
+            user = row.get('User', '')
+            if user not in users:
+                users[user] = len(users) + 1
+                new_users.append((users[user], user))
+            project = row.get('Project', '')
+            if project not in projects:
+                projects[project] = len(projects) + 1
+                new_projects.append((projects[project], project, row.get('Project Code', ''), row.get('Client', '')))
+            activities.append((
+                next_id,
+                parse_day(row['Day']).toordinal(),
+                users[user],
+                projects[project],
+                parse_clock(row['Start Time']),
+                parse_clock(row['End Time']),
+                parse_duration(row['Duration']),
+                row.get('Time Entry', ''),
+                row.get('Work Type', ''),
+            ))
+            tags.extend((next_id, tag) for tag in row_tags(row))
+            next_id += 1
+
+        with self.conn:  # one transaction for the whole file
+            self.conn.executemany('INSERT INTO users (id, name) VALUES (?, ?)', new_users)
+            self.conn.executemany('INSERT INTO projects (id, name, code, client) VALUES (?, ?, ?, ?)', new_projects)
+            added = self.conn.executemany('INSERT OR IGNORE INTO activities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                          activities).rowcount
+            # only the tags of the activities that were not skipped
+            self.conn.executemany('INSERT INTO activity_tags (activity_id, tag) SELECT ?, ? '
+                                  'WHERE EXISTS (SELECT 1 FROM activities WHERE id = ?)',
+                                  [(activity_id, tag, activity_id) for activity_id, tag in tags])
+        return added
+
+    def _where(self, user: Optional[str] = None, project: Optional[str] = None,
+               start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None):
+        '''
+        builds the WHERE clause (on the activities table aliased as a) for the given filters
+        :return: tuple (sql, parameters)
+        '''
+        clauses = []
+        params = []
+        if user is not None:
+            clauses.append('a.user_id = (SELECT id FROM users WHERE name = ?)')
+            params.append(user)
+        if project is not None:
+            clauses.append('a.project_id = (SELECT id FROM projects WHERE name = ?)')
+            params.append(project)
+        if start_date is not None:
+            clauses.append('a.day >= ?')
+            params.append(start_date.toordinal())
+        if end_date is not None:
+            clauses.append('a.day <= ?')
+            params.append(end_date.toordinal())
+        if not clauses:
+            return '', params
+        return ' WHERE ' + ' AND '.join(clauses), params
+
+    def hours_per_day(self, **filters) -> Dict[datetime.date, datetime.timedelta]:
+        '''
+        computes work hours per day
+        :param filters: user, project, start_date, end_date (all optional)
+        :return: dict with keys: dates, values: timedelta
+        '''
+        where, params = self._where(**filters)
+        query = 'SELECT a.day, SUM(a.duration) FROM activities a{} GROUP BY a.day'.format(where)
+        return {datetime.date.fromordinal(day): datetime.timedelta(seconds=seconds)
+                for day, seconds in self.conn.execute(query, params)}
+
+    def hours_per_week(self, **filters) -> Dict[datetime.date, datetime.timedelta]:
+        '''
+        computes work hours per week
+        :param filters: user, project, start_date, end_date (all optional)
+        :return: dict with keys: start dates (Mondays) of a week, values: timedelta
+        '''
+        where, params = self._where(**filters)
+        # ordinal 1 (1 Jan 0001) is a Monday, so (day - 1) % 7 is the weekday with Monday = 0
+        query = ('SELECT a.day - (a.day - 1) % 7 AS week, SUM(a.duration) FROM activities a{} '
+                 'GROUP BY week'.format(where))
+        return {datetime.date.fromordinal(week): datetime.timedelta(seconds=seconds)
+                for week, seconds in self.conn.execute(query, params)}
+
+    def worked_days(self, hour_threshold=datetime.timedelta(hours=4), **filters) -> List[datetime.date]:
+        '''
+        lists the days with more than hour_threshold work
+        :param hour_threshold: timedelta
+        :param filters: user, project, start_date, end_date (all optional)
+        :return: sorted list of dates
+        '''
+        where, params = self._where(**filters)
+        query = 'SELECT a.day FROM activities a{} GROUP BY a.day HAVING SUM(a.duration) > ? ORDER BY a.day'.format(where)
+        params.append(hour_threshold.total_seconds())
+        return [datetime.date.fromordinal(day) for (day,) in self.conn.execute(query, params)]
+
+    def holidays(self, start_date: datetime.date, end_date: datetime.date, exclude_weekend: bool = True,
+                 hour_threshold=datetime.timedelta(hours=4), user: Optional[str] = None,
+                 project: Optional[str] = None) -> List[datetime.date]:
+        '''
+        lists all days between start_date and end_date inclusive with at most hour_threshold work,
+        see Work.holidays
+        :return: list of dates
+        '''
+        worked = set(self.worked_days(hour_threshold, user=user, project=project,
+                                      start_date=start_date, end_date=end_date))
+        return _holidays(start_date, end_date, worked, exclude_weekend)
+
+    def hours_per_tag(self, **filters) -> Dict[str, datetime.timedelta]:
+        '''
+        computes the total time spent per tag
+        :param filters: user, project, start_date, end_date (all optional)
+        :return: dict with keys: tags, values: timedelta
+        '''
+        where, params = self._where(**filters)
+        query = ('SELECT t.tag, SUM(a.duration) FROM activity_tags t JOIN activities a ON a.id = t.activity_id{} '
+                 'GROUP BY t.tag'.format(where))
+        return {tag: datetime.timedelta(seconds=seconds) for tag, seconds in self.conn.execute(query, params)}
+
+    def rows(self, **filters):
+        '''
+        generates the stored activities as tmetric CSV rows (dicts), e.g. to construct Activity objects
+        :param filters: user, project, start_date, end_date (all optional)
+        '''
+        where, params = self._where(**filters)
+        query = ('SELECT a.day, u.name, p.name, p.code, p.client, a.entry, a.work_type, a.start_time, a.end_time, '
+                 'a.duration FROM activities a JOIN users u ON u.id = a.user_id '
+                 'JOIN projects p ON p.id = a.project_id{} ORDER BY a.id'.format(where))
+        for day, user, project, code, client, entry, work_type, start, end, duration in self.conn.execute(query, params):
+            yield {
+                'Day': '{:%d/%m/%Y}'.format(datetime.date.fromordinal(day)),
+                'User': user,
+                'Project': project,
+                'Project Code': code,
+                'Client': client,
+                'Time Entry': entry,
+                'Work Type': work_type,
+                'Start Time': _clock_str(start),
+                'End Time': _clock_str(end),
+                'Duration': '%d:%02d' % divmod(duration // 60, 60),
+            }
+
+
+def main():
+    store = ActivityStore('data/tmetric.sqlite')
+    n = store.load_csv('data/tmetric.csv')
+    print('loaded {} activities into {}'.format(n, store.db_path))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import csv
+import datetime
+import random
+import sys
+import time
+from collections import deque, namedtuple
+from typing import List
+
+from tmetric_io import open_text, parse_day, parse_duration
+
+
+# an alert raised by a rule, day is the date of the entry that tripped it
+Alert = namedtuple('Alert', ['rule', 'user', 'day', 'message'])
+
+
+def _seconds(duration) -> int:
+    if isinstance(duration, datetime.timedelta):
+        return int(duration.total_seconds())
+    return int(duration)
+
+
+class RollingHoursRule(object):
+    '''
+    alerts when a user works more than max_hours within window_days consecutive days
+    '''
+    name = 'rolling_hours'
+
+    def __init__(self, max_hours: float = 60, window_days: int = 7) -> None:
+        self.max_seconds = max_hours * 3600
+        self.window_days = window_days
+
+    def new_state(self) -> dict:
+        # window: [day ordinal, seconds] per day, sorted by day, only the last window_days days
+        return {'window': deque(), 'total': 0, 'alerted': False}
+
+    def update(self, state: dict, user: str, day: int, seconds: int):
+        window = state['window']
+        if window and day <= window[-1][0] - self.window_days:
+            return None  # late entry for a day that left the window already
+        if not window or day > window[-1][0]:
+            window.append([day, seconds])
+            while window[0][0] <= day - self.window_days:
+                state['total'] -= window.popleft()[1]
+        else:
+            for i, entry in enumerate(window):  # out of order entry within the window: O(window)
+                if entry[0] == day:
+                    entry[1] += seconds
+                    break
+                if entry[0] > day:
+                    window.insert(i, [day, seconds])
+                    break
+        state['total'] += seconds
+
+        if state['total'] <= self.max_seconds:
+            state['alerted'] = False
+            return None
+        if state['alerted']:
+            return None  # only alert when the limit is crossed, not for every further entry
+        state['alerted'] = True
+        # the window ends at its last day, which is not the day of an out of order entry
+        last = window[-1][0]
+        first = datetime.date.fromordinal(last - self.window_days + 1)
+        return Alert(self.name, user, datetime.date.fromordinal(day),
+                     '{:.1f}h worked between {} and {} (limit {:.0f}h)'.format(
+                         state['total'] / 3600, first, datetime.date.fromordinal(last), self.max_seconds / 3600))
+
+
+class WeekendStreakRule(object):
+    '''
+    alerts when a user worked more than hour_threshold on a Saturday or Sunday for min_weeks weekends in a row
+    '''
+    name = 'weekend_streak'
+
+    def __init__(self, min_weeks: int = 3, hour_threshold: float = 4) -> None:
+        self.min_weeks = min_weeks
+        self.threshold_seconds = hour_threshold * 3600
+
+    def new_state(self) -> dict:
+        # seconds: day ordinal -> seconds worked, for the days of the weekend of week (the ordinal of its Monday)
+        return {'week': None, 'seconds': {}, 'last_week': None, 'streak': 0}
+
+    def update(self, state: dict, user: str, day: int, seconds: int):
+        if (day - 1) % 7 < 5:  # not a weekend day
+            return None
+        week = day - (day - 1) % 7
+        if week != state['week']:
+            if state['week'] is not None and week < state['week']:
+                return None  # late entry for a weekend that is over already
+            state['week'] = week
+            state['seconds'] = {}
+        before = state['seconds'].get(day, 0)
+        state['seconds'][day] = before + seconds
+        if not before <= self.threshold_seconds < state['seconds'][day]:
+            return None
+
+        # this day just became a worked weekend day
+        if state['last_week'] == week:
+            return None  # the other day of this weekend counted already
+        state['streak'] = state['streak'] + 1 if state['last_week'] == week - 7 else 1
+        state['last_week'] = week
+        if state['streak'] < self.min_weeks:
+            return None
+        return Alert(self.name, user, datetime.date.fromordinal(day),
+                     'worked {} weekends in a row'.format(state['streak']))
+
+
+RULES = {rule.name: rule for rule in (RollingHoursRule, WeekendStreakRule)}
+
+
+def rules_from_config(config: List[dict]) -> list:
+    """
+    creates rules from a list of dicts like {'rule': 'rolling_hours', 'max_hours': 50, 'window_days': 7}
+    """
+    rules = []
+    for options in config:
+        options = dict(options)
+        rules.append(RULES[options.pop('rule')](**options))
+    return rules
+
+
+class AlertEvaluator(object):
+    '''
+    evaluates rules on a stream of time entries, keeping a small state per user and rule
+    '''
+    def __init__(self, rules=None) -> None:
+        """
+        :param rules: list of rules, default: more than 60h in 7 days and 3 worked weekends in a row
+        """
+        self.rules = rules if rules is not None else [RollingHoursRule(), WeekendStreakRule()]
+        self.states = {}  # user -> list of rule states
+
+    def feed(self, user: str, day, duration) -> List[Alert]:
+        """
+        processes one time entry
+        :param user: name of the user
+        :param day: datetime.date or day ordinal
+        :param duration: timedelta or seconds
+        :return: list of alerts raised by this entry
+        """
+        if isinstance(day, datetime.date):
+            day = day.toordinal()
+        seconds = _seconds(duration)
+        states = self.states.get(user)
+        if states is None:
+            states = self.states[user] = [rule.new_state() for rule in self.rules]
+        alerts = []
+        for rule, state in zip(self.rules, states):
+            alert = rule.update(state, user, day, seconds)
+            if alert is not None:
+                alerts.append(alert)
+        return alerts
+
+    def feed_activity(self, act) -> List[Alert]:
+        return self.feed(act.user, act.day, act.duration)
+
+    def feed_row(self, row: dict) -> List[Alert]:
+        return self.feed(row.get('User', ''), parse_day(row['Day']), parse_duration(row['Duration']))
+
+    def run(self, rows):
+        """
+        generates the alerts of a stream of tmetric CSV rows
+        """
+        for row in rows:
+            yield from self.feed_row(row)
+
+
+def benchmark(n: int = 1000000, users: int = 100) -> float:
+    """
+    feeds n synthetic entries (in chronological order) to an evaluator with the default rules
+    :return: entries per second
+    """
+    random.seed(0)
+    day = datetime.date(2010, 1, 1).toordinal()
+    entries = []
+    for i in range(n):
+        if i % (users * 4) == 0:
+            day += 1
+        entries.append(('user{}'.format(random.randrange(users)), day, random.randrange(900, 4 * 3600, 900)))
+    evaluator = AlertEvaluator()
+    start = time.perf_counter()
+    for user, day, seconds in entries:
+        evaluator.feed(user, day, seconds)
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'data/tmetric.csv'
+    evaluator = AlertEvaluator()
+    with open_text(filename) as csvfile:
+        for alert in evaluator.run(csv.DictReader(csvfile)):
+            print('{:%a %d %b %Y} {}: {} ({})'.format(alert.day, alert.user, alert.message, alert.rule))
+    print('{:.0f} entries/second'.format(benchmark()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# scales and palettes of the work hours calendars, shared by the matplotlib (holiday_calendar_colormap) and the
+# SVG (svg_calendar) renderer. Kept free of matplotlib, so the SVG renderer does not need it
+
+
+# We'll interpolate between threshold and a max reasonable workday (e.g., 14h)
+MAX_HOURS = 14.0
+# Maximum for weekly color scale (e.g. 62h)
+WEEK_MAX = 62
+
+# Custom palette: (position, color) anchors for 0h to MAX_HOURS
+CUSTOM_ANCHORS = [
+    (0.0, '#ffffff'),     # white, 0h
+    (1/14, '#90ee90'),    # lightgreen, >0h up to 2h
+    (4/14, '#ffff00'),    # yellow, >2h up to 4h
+    (6/14, '#ffa500'),    # orange, >4h up to 6h
+    (8/14, '#ff0000'),    # red, >6h up to 8h
+    (1.0, '#800080'),     # purple, >8h up to 14h
+]
+
+
+def _evenly_spaced(colors):
+    return [(i / (len(colors) - 1), color) for i, color in enumerate(colors)]
+
+
+# colormaps as (position, hex color) anchors, interpolated linearly. The matplotlib maps are sampled at 33 points,
+# holiday_calendar_colormap draws them with matplotlib itself and custom from CUSTOM_ANCHORS.
+# Every map can be reversed by appending '_r' to its name
+COLORMAP_ANCHORS = {
+    'viridis': _evenly_spaced([
+        '#440154', '#470d60', '#48186a', '#482374', '#472d7b', '#453781', '#424086', '#3e4989', '#3b528b',
+        '#375b8d', '#33638d', '#2f6b8e', '#2c728e', '#297a8e', '#26828e', '#23898e', '#21918c', '#1f988b',
+        '#1fa088', '#22a785', '#28ae80', '#32b67a', '#3fbc73', '#4ec36b', '#5ec962', '#70cf57', '#84d44b',
+        '#98d83e', '#addc30', '#c2df23', '#d8e219', '#ece51b', '#fde725']),
+    'plasma': _evenly_spaced([
+        '#0d0887', '#220690', '#310597', '#3f049c', '#4c02a1', '#5901a5', '#6600a7', '#7201a8', '#7e03a8',
+        '#8a09a5', '#9511a1', '#a01a9c', '#aa2395', '#b32c8e', '#bc3587', '#c43e7f', '#cc4778', '#d35171',
+        '#da5a6a', '#e06363', '#e66c5c', '#eb7655', '#f0804e', '#f58b47', '#f89540', '#fba139', '#fdac33',
+        '#feb82c', '#fdc527', '#fcd225', '#f8df25', '#f4ed27', '#f0f921']),
+    'inferno': _evenly_spaced([
+        '#000004', '#040312', '#0b0724', '#150b37', '#210c4a', '#2f0a5b', '#3d0965', '#4a0c6b', '#57106e',
+        '#64156e', '#71196e', '#7d1e6d', '#8a226a', '#972766', '#a32c61', '#b0315b', '#bc3754', '#c73e4c',
+        '#d24644', '#db503b', '#e45a31', '#eb6628', '#f1731d', '#f68013', '#f98e09', '#fb9d07', '#fcac11',
+        '#fbbc21', '#f9cb35', '#f5db4c', '#f2ea69', '#f3f68a', '#fcffa4']),
+    'turbo': _evenly_spaced([
+        '#30123b', '#392a73', '#4040a2', '#4456c7', '#466be3', '#4680f6', '#4294ff', '#37a8fa', '#28bceb',
+        '#1ccdd8', '#18ddc2', '#1fe9af', '#32f298', '#4ef97d', '#6dfe62', '#8bff4b', '#a4fc3c', '#b9f635',
+        '#cdec34', '#dfdf37', '#eecf3a', '#f8be39', '#fdac34', '#fe962b', '#fb7e21', '#f46617', '#eb500e',
+        '#df3f08', '#d02f05', '#be2102', '#a91601', '#920b01', '#7a0403']),
+    'cividis': _evenly_spaced([
+        '#00224e', '#00285b', '#002e6a', '#053371', '#1a386f', '#273e6e', '#32436d', '#3b496c', '#434e6c',
+        '#4b546c', '#535a6d', '#5a5f6e', '#61656f', '#686a71', '#6f7073', '#767676', '#7d7c78', '#848279',
+        '#8c8878', '#938e78', '#9b9476', '#a39a74', '#aba072', '#b4a76f', '#bcae6c', '#c4b468', '#cdbb63',
+        '#d5c25e', '#dec958', '#e7d150', '#f0d846', '#f9e03a', '#fee838']),
+    'custom': CUSTOM_ANCHORS,
+}
+
+
+def base_colormap(cmap_name: str) -> str:
+    """
+    returns the name of the map in COLORMAP_ANCHORS of cmap_name, i.e. without a '_r' suffix
+    :raises ValueError: for other colormaps
+    """
+    base_name = cmap_name[:-2] if cmap_name.endswith('_r') else cmap_name
+    if base_name not in COLORMAP_ANCHORS:
+        raise ValueError('unknown colormap {!r}, use one of {} (or append _r to reverse)'.format(
+            cmap_name, ', '.join(COLORMAP_ANCHORS)))
+    return base_name
@@ -0,0 +1,265 @@
+import datetime
+import hashlib
+import io
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import matplotlib
+matplotlib.use('Agg')  # the calendars are only rendered to PNG, selected once before pyplot is imported
+import matplotlib.pyplot as plt
+
+from rollup_cube import RollupCube
+from timekeeping import Work
+
+
+DEFAULT_THRESHOLD = 4.0  # hours, as Work.holidays and Work.weekends
+CACHE_SIZE = 256
+
+
+class Snapshot(object):
+    '''
+    read-only aggregates of a Work object, computed once. A new snapshot is built for new data and swapped in as a
+    whole, so requests never see a half updated state
+    '''
+    def __init__(self, work: Work, version: str = None) -> None:
+        tag_hours = {}
+        for (year, tag), td in work.group_by('year', 'tag').items():
+            tag_hours.setdefault(year, {})[tag] = td
+        self._aggregate(work.hours_per_day(), work.hours_per_week(), tag_hours, version)
+
+    @classmethod
+    def from_cube(cls, cube: RollupCube, version: str = None) -> 'Snapshot':
+        """
+        takes the aggregates from the cells of a rollup cube instead of the activities, the same as Snapshot(Work)
+        if the cube parses Day as Activity does (the default of RollupCube.build)
+        """
+        snapshot = cls.__new__(cls)
+        snapshot._aggregate(cube.hours_per_day(), cube.hours_per_week(),
+                            {year: cube.hours_per_tag(year) for year in cube.years()}, version)
+        return snapshot
+
+    def _aggregate(self, day_hours, week_hours, tag_hours, version):
+        # day_hours, week_hours: date -> timedelta, tag_hours: year -> tag -> timedelta
+        self.day_hours = {day: td.total_seconds() / 3600 for day, td in sorted(day_hours.items())}
+        self.week_hours = {week: td.total_seconds() / 3600 for week, td in sorted(week_hours.items())}
+        self.tag_hours = {year: {tag: td.total_seconds() / 3600 for tag, td in tags.items()}
+                          for year, tags in tag_hours.items()}
+        if version is None:
+            # all data served, so a change in any of them gives a new version
+            version = hashlib.sha1(repr((sorted(self.day_hours.items()), sorted(self.week_hours.items()),
+                                         sorted((year, sorted(tags.items())) for year, tags in self.tag_hours.items())
+                                         )).encode()).hexdigest()[:12]
+        self.version = version
+        self.first_day = min(self.day_hours, default=datetime.date.today())
+        self.last_day = max(self.day_hours, default=datetime.date.today())
+
+    def _range(self, start, end):
+        day = start
+        while day <= end:
+            yield day
+            day += datetime.timedelta(days=1)
+
+    def holidays(self, start, end, threshold=DEFAULT_THRESHOLD, exclude_weekend=True):
+        # days with at most threshold hours, as Work.holidays
+        return [day for day in self._range(start, end)
+                if self.day_hours.get(day, 0.0) <= threshold and not (exclude_weekend and day.weekday() >= 5)]
+
+    def weekends(self, start, end, threshold=DEFAULT_THRESHOLD):
+        # weekend days with more than threshold hours, as Work.weekends
+        return [day for day in self._range(start, end) if day.weekday() >= 5 and self.day_hours.get(day, 0.0) > threshold]
+
+
+def _date_arg(query, name, default):
+    if name in query:
+        return datetime.date.fromisoformat(query[name][0])
+    return default
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match is * or a comma separated list of quoted, possibly weak (W/"..."), entity tags
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+
+def _json_days(hours):
+    return {day.isoformat(): round(h, 4) for day, h in hours.items()}
+
+
+class Dashboard(object):
+    '''
+    serves the aggregates of the current snapshot, responses are cached per snapshot version
+    '''
+    def __init__(self, snapshot: Snapshot, cache_size: int = CACHE_SIZE) -> None:
+        self.snapshot = snapshot
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # (version, path) -> (etag, content type, body)
+        self.cache_lock = threading.Lock()
+        self.render_lock = threading.Lock()  # pyplot is not thread safe
+
+    def swap(self, snapshot: Snapshot) -> None:
+        # readers keep using the snapshot they started with
+        self.snapshot = snapshot
+
+    def reload(self, filename: str) -> threading.Thread:
+        """
+        builds a new snapshot from filename in the background and swaps it in when ready. The aggregates come from
+        the rollup cube of filename, which is only rebuilt if the file changed
+        """
+        thread = threading.Thread(target=lambda: self.swap(Snapshot.from_cube(RollupCube.load_or_build(filename))),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def response(self, path: str):
+        """
+        :return: tuple (etag, content type, body) for path (including query string), cached
+        """
+        snapshot = self.snapshot
+        key = (snapshot.version, path)
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        content_type, body = self.render(snapshot, path)
+        etag = '"{}-{}"'.format(snapshot.version, hashlib.sha1(body).hexdigest()[:16])
+        with self.cache_lock:
+            self.cache[key] = (etag, content_type, body)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return etag, content_type, body
+
+    def render(self, snapshot: Snapshot, path: str):
+        """
+        :return: tuple (content type, body), raises KeyError for unknown paths and ValueError for bad arguments
+        """
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        start = _date_arg(query, 'start', snapshot.first_day)
+        end = _date_arg(query, 'end', snapshot.last_day)
+        threshold = float(query.get('threshold', [DEFAULT_THRESHOLD])[0])
+
+        if url.path == '/api/days':
+            data = _json_days({d: h for d, h in snapshot.day_hours.items() if start <= d <= end})
+        elif url.path == '/api/weeks':
+            data = _json_days({w: h for w, h in snapshot.week_hours.items() if start <= w <= end})
+        elif url.path == '/api/holidays':
+            exclude_weekend = query.get('exclude_weekend', ['1'])[0] not in ('0', 'false')
+            data = [d.isoformat() for d in snapshot.holidays(start, end, threshold, exclude_weekend)]
+        elif url.path == '/api/weekends':
+            data = [d.isoformat() for d in snapshot.weekends(start, end, threshold)]
+        elif url.path == '/api/tags':
+            year = int(query.get('year', [snapshot.last_day.year])[0])
+            data = snapshot.tag_hours.get(year, {})
+        elif url.path.startswith('/calendar/') and url.path.endswith('.png'):
+            return 'image/png', self.render_calendar(snapshot, int(url.path[len('/calendar/'):-len('.png')]),
+                                                     query.get('cmap', ['viridis_r'])[0])
+        else:
+            raise KeyError(url.path)
+        return 'application/json', json.dumps(data).encode()
+
+    def render_calendar(self, snapshot: Snapshot, year: int, cmap_name: str) -> bytes:
+        from holiday_calendar_colormap import colormap_calendar_figure
+
+        day_hours = {d: h for d, h in snapshot.day_hours.items() if d.year == year}
+        buffer = io.BytesIO()
+        with self.render_lock:
+            fig = colormap_calendar_figure(year, day_hours, cmap_name)
+            fig.savefig(buffer, format='png')
+            plt.close(fig)
+        return buffer.getvalue()
+
+    def handler(self):
+        dashboard = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    etag, content_type, body = dashboard.response(self.path)
+                except KeyError:
+                    self.send_error(404)
+                    return
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                except Exception as e:
+                    # any other failure (e.g. while rendering a calendar) still gets a response
+                    self.send_error(500, type(e).__name__)
+                    return
+                if _etag_matches(self.headers.get('If-None-Match', ''), etag):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def server(self, host: str = '127.0.0.1', port: int = 8000) -> ThreadingHTTPServer:
+        return ThreadingHTTPServer((host, port), self.handler())
+
+
+def load_test(base_url: str, paths, n: int = 5000, concurrency: int = 16, etag: bool = False) -> dict:
+    """
+    requests the paths n times in total from concurrency threads
+    :param etag: send If-None-Match with the ETag of the first response
+    :return: dict with requests per second and latency percentiles (ms)
+    """
+    etags = {}
+    if etag:
+        for path in paths:
+            with urllib.request.urlopen(base_url + path) as r:
+                r.read()
+                etags[path] = r.headers['ETag']
+
+    def get(i):
+        path = paths[i % len(paths)]
+        request = urllib.request.Request(base_url + path)
+        if path in etags:
+            request.add_header('If-None-Match', etags[path])
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as r:
+                r.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = sorted(pool.map(get, range(n)))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests/s': n / elapsed,
+        'p50 ms': 1000 * latencies[n // 2],
+        'p99 ms': 1000 * latencies[min(n - 1, int(n * 0.99))],
+    }
+
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'data/tmetric.csv'
+    dashboard = Dashboard(Snapshot.from_cube(RollupCube.load_or_build(filename)))
+    server = dashboard.server()
+    print('serving {} on http://{}:{}/'.format(filename, *server.server_address))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
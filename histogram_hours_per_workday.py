@@ -1,72 +1,199 @@
 
-import csv
 import datetime
-import matplotlib.pyplot as plt
-from collections import defaultdict
 import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from periods import PERIODS, CalendarTable
+import rollup_cube
+from tmetric_io import calendar_day, csv_header, read_columns
 
 INPUT_FILE = 'data/tmetric_processed.csv'
 
+BINS = np.arange(0, 20)  # bin edges in hours, as ax.hist(bins=range(0, 20)) did
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# groupings besides periods.PERIODS: the month of the year (1-12), the type of day (DAY_TYPES) and the labels
+DAY_TYPES = ['Mon-Fri', 'Saturday', 'Sunday']
+LABELS = ('user', 'project')
+GROUPINGS = PERIODS + ('month_of_year', 'day_type') + LABELS
+
+# histogram and quantiles of the hours per day of every group:
+# groups: list of group keys (tuples if grouped by several keys), bins: the bin edges,
+# counts: number of days per group and bin (days outside the bins are not counted, as in np.histogram),
+# quantiles: hours per group and quantile level, days: number of days per group
+Distribution = namedtuple('Distribution', ['by', 'groups', 'bins', 'counts', 'quantile_levels', 'quantiles', 'days'])
+
+
+class DayHours(object):
+    '''
+    (email adjusted) hours worked, as arrays of day ordinals, hours and user and project indices, read once.
+    distribution() computes histograms and quantiles of the hours per day for any grouping from these arrays
+    '''
+    def __init__(self, day: np.ndarray, hours: np.ndarray, user: np.ndarray = None, project: np.ndarray = None,
+                 users=(), projects=()) -> None:
+        self.day = np.asarray(day, dtype=np.int64)
+        self.hours = np.asarray(hours, dtype=float)
+        self.labels = {
+            'user': (np.zeros(len(self.day), dtype=np.int64) if user is None else np.asarray(user, dtype=np.int64),
+                     list(users) or ['']),
+            'project': (np.zeros(len(self.day), dtype=np.int64) if project is None
+                        else np.asarray(project, dtype=np.int64), list(projects) or ['']),
+        }
+        self._calendar = None
 
-# Read processed data and sum hours per day type
-weekday_hours = defaultdict(float)
-saturday_hours = defaultdict(float)
-sunday_hours = defaultdict(float)
-with open(INPUT_FILE, newline='', encoding='utf-8') as f:
-    reader = csv.DictReader(f)
-    for row in reader:
-        # Parse date
-        day = row.get('parsed_day') or row.get('Day')
-        if not day:
-            continue
-        try:
-            date_obj = datetime.datetime.strptime(day, '%Y-%m-%d').date()
-        except Exception:
-            try:
-                date_obj = datetime.datetime.strptime(day, '%d/%m/%Y').date()
-            except Exception:
+    @classmethod
+    def read(cls, input_file: str = INPUT_FILE) -> 'DayHours':
+        """
+        reads the day, the adjusted hours, the user and the project of a processed file (Day if it has no parsed_day)
+        """
+        header = csv_header(input_file, encoding='utf-8')
+        columns = ['parsed_day' if 'parsed_day' in header else 'Day', 'Duration adjusted (hours)']
+        columns += [column for column in ('User', 'Project') if column in header]
+        days, hours, user, project = [], [], [], []
+        users, projects = {}, {}
+        for values in read_columns(input_file, columns, encoding='utf-8'):
+            day = calendar_day(values[0]) if values[0] else None
+            if day is None:
                 continue
-        hours = float(row.get('Duration adjusted (hours)', 0))
-        wd = date_obj.weekday()
-        if wd < 5:
-            weekday_hours[date_obj] += hours
-        elif wd == 5:
-            saturday_hours[date_obj] += hours
-        elif wd == 6:
-            sunday_hours[date_obj] += hours
-
-# Prepare data for histograms
-weekday_list = list(weekday_hours.values())
-saturday_list = list(saturday_hours.values())
-sunday_list = list(sunday_hours.values())
-
-# Ensure plots directory exists
-os.makedirs('plots', exist_ok=True)
-
-# Plot all histograms, but only save the last (Sunday)
-fig, axes = plt.subplots(3, 1, figsize=(8, 12))
-
-axes[0].hist(weekday_list, bins=range(0, 20), edgecolor='black', align='left')
-axes[0].set_xlabel('Hours worked per work-day (Mon-Fri)')
-axes[0].set_ylabel('Number of days')
-axes[0].set_title('Histogram of Hours Worked per Work-Day (Mon-Fri)')
-axes[0].set_xticks(range(0, 20))
-axes[0].grid(axis='y', linestyle='--', alpha=0.7)
-
-axes[1].hist(saturday_list, bins=range(0, 20), edgecolor='black', align='left', color='orange')
-axes[1].set_xlabel('Hours worked per Saturday')
-axes[1].set_ylabel('Number of Saturdays')
-axes[1].set_title('Histogram of Hours Worked per Saturday')
-axes[1].set_xticks(range(0, 20))
-axes[1].grid(axis='y', linestyle='--', alpha=0.7)
-
-axes[2].hist(sunday_list, bins=range(0, 20), edgecolor='black', align='left', color='green')
-axes[2].set_xlabel('Hours worked per Sunday')
-axes[2].set_ylabel('Number of Sundays')
-axes[2].set_title('Histogram of Hours Worked per Sunday')
-axes[2].set_xticks(range(0, 20))
-axes[2].grid(axis='y', linestyle='--', alpha=0.7)
-
-fig.tight_layout()
-fig.savefig('plots/histograms.png')
-plt.show()
+            row = dict(zip(columns[2:], values[2:]))
+            days.append(day.toordinal())
+            hours.append(float(values[1]) if values[1] else 0.0)
+            user.append(users.setdefault(row.get('User', ''), len(users)))
+            project.append(projects.setdefault(row.get('Project', ''), len(projects)))
+        return cls(days, hours, user, project, users, projects)
+
+    @classmethod
+    def from_cube(cls, cube, adjusted: bool = True) -> 'DayHours':
+        """
+        takes the hours from the cells of a rollup_cube.RollupCube instead of reading a file. Use
+        rollup_cube.pipeline_cube to get the days and hours of read()
+        """
+        seconds = cube.adjusted_seconds() if adjusted else cube.seconds
+        return cls(cube.day, seconds / 3600, cube.user, cube.project, cube.users, cube.projects)
+
+    def calendar(self) -> CalendarTable:
+        if self._calendar is None:
+            first, last = (int(self.day.min()), int(self.day.max())) if len(self.day) else (1, 1)
+            self._calendar = CalendarTable(datetime.date.fromordinal(first), datetime.date.fromordinal(last))
+        return self._calendar
+
+    def _codes(self, key: str, days: np.ndarray) -> np.ndarray:
+        calendar = self.calendar()
+        if key == 'month_of_year':
+            return calendar.month[days - calendar.first]
+        if key == 'day_type':
+            weekday = calendar.weekday[days - calendar.first]
+            return np.where(weekday <= 5, 0, weekday - 5)  # index into DAY_TYPES
+        return calendar.lookup(key, days)
+
+    def _decode(self, key: str, code: int):
+        if key in LABELS:
+            return self.labels[key][1][int(code)]
+        if key == 'month_of_year':
+            return int(code)
+        if key == 'day_type':
+            return DAY_TYPES[int(code)]
+        return CalendarTable.decode(key, code)
+
+    def distribution(self, by='day_type', bins=BINS, quantiles=QUANTILES) -> Distribution:
+        """
+        sums the hours per day (and per user/project if grouped by those) and computes the histogram and quantiles
+        of these daily hours for every group, in one vectorized pass
+        :param by: one of GROUPINGS, or a tuple of them, e.g. ('user', 'year')
+        :param bins: increasing bin edges in hours
+        :param quantiles: quantile levels between 0 and 1 (linear interpolation, as np.quantile)
+        :return: Distribution
+        """
+        keys = (by,) if isinstance(by, str) else tuple(by)
+        unknown = [key for key in keys if key not in GROUPINGS]
+        if unknown:
+            raise ValueError('cannot group by {}, use one of {}'.format(', '.join(unknown), ', '.join(GROUPINGS)))
+        edges = np.asarray(bins, dtype=float)
+        levels = np.asarray(quantiles, dtype=float)
+        if not len(self.day):
+            return Distribution(by, [], edges, np.zeros((0, len(edges) - 1), dtype=np.int64), levels,
+                                np.zeros((0, len(levels))), np.zeros(0, dtype=np.int64))
+
+        # hours per day, per (day, user) etc. if grouped by labels
+        label_keys = [key for key in keys if key in LABELS]
+        units, inverse = np.unique(np.stack([self.day] + [self.labels[key][0] for key in label_keys]), axis=1,
+                                   return_inverse=True)
+        hours = np.bincount(inverse.ravel(), weights=self.hours, minlength=units.shape[1])
+        days = units[0]
+
+        group_codes = np.stack([units[1 + label_keys.index(key)] if key in LABELS else self._codes(key, days)
+                                for key in keys])
+        group_codes, group_index = np.unique(group_codes, axis=1, return_inverse=True)
+        group_index = group_index.ravel()
+        n_groups = group_codes.shape[1]
+
+        # histogram: bins include their left edge, the last bin also its right edge
+        n_bins = len(edges) - 1
+        bin_index = np.searchsorted(edges, hours, side='right') - 1
+        bin_index[hours == edges[-1]] = n_bins - 1
+        inside = (bin_index >= 0) & (bin_index < n_bins)
+        counts = np.bincount(group_index[inside] * n_bins + bin_index[inside],
+                             minlength=n_groups * n_bins).reshape(n_groups, n_bins)
+
+        # quantiles: sort the hours by group, then interpolate within every group's slice
+        n_days = np.bincount(group_index, minlength=n_groups)
+        sorted_hours = hours[np.lexsort((hours, group_index))]
+        starts = np.cumsum(n_days) - n_days
+        position = levels[np.newaxis, :] * (n_days[:, np.newaxis] - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        low_hours = sorted_hours[starts[:, np.newaxis] + low]
+        high_hours = sorted_hours[starts[:, np.newaxis] + high]
+        quantile_hours = low_hours + (high_hours - low_hours) * (position - low)
+
+        groups = [tuple(self._decode(key, code) for key, code in zip(keys, codes)) for codes in group_codes.T]
+        if isinstance(by, str):
+            groups = [group[0] for group in groups]
+        return Distribution(by, groups, edges, counts, levels, quantile_hours, n_days)
+
+
+def plot_distribution(distribution: Distribution, filename: str = None, show: bool = True):
+    """
+    plots the histogram of every group of a distribution below each other
+    :param filename: save the figure to this file (optional)
+    :return: the figure
+    """
+    import matplotlib.pyplot as plt
+
+    edges = distribution.bins
+    n_groups = max(len(distribution.groups), 1)
+    fig, axes = plt.subplots(n_groups, 1, figsize=(8, 4 * n_groups), squeeze=False)
+    for ax, group, counts, color in zip(axes[:, 0], distribution.groups, distribution.counts,
+                                        ['C0', 'orange', 'green'] * n_groups):
+        label = ' '.join(str(g) for g in group) if isinstance(group, tuple) else str(group)
+        ax.bar(edges[:-1], counts, width=np.diff(edges), color=color, edgecolor='black')
+        ax.set_xlabel('Hours worked per day ({})'.format(label))
+        ax.set_ylabel('Number of days')
+        ax.set_title('Histogram of Hours Worked per Day ({})'.format(label))
+        ax.set_xticks(edges)
+        ax.grid(axis='y', linestyle='--', alpha=0.7)
+    fig.tight_layout()
+    if filename:
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        fig.savefig(filename)
+    if show:
+        plt.show()
+    return fig
+
+
+def main():
+    # the (raw) export, its adjusted hours are taken from its rollup cube
+    input_file = sys.argv[1] if len(sys.argv) > 1 else rollup_cube.INPUT_FILE
+    day_hours = DayHours.from_cube(rollup_cube.pipeline_cube(input_file))
+    distribution = day_hours.distribution('day_type')
+    for group, levels, n in zip(distribution.groups, distribution.quantiles, distribution.days):
+        print('{}: {} days, quantiles {}'.format(group, n, ', '.join(
+            '{:.0%} {:.1f}h'.format(q, h) for q, h in zip(distribution.quantile_levels, levels))))
+    plot_distribution(distribution, 'plots/histograms.png')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,139 @@
-import csv
+import bisect
 import datetime
 import calendar
 import matplotlib.pyplot as plt
-from collections import defaultdict
 import os
 
+import render_cache
+import rollup_cube
+import tmetric_io
+from timezones import TimezoneConfig
+
 INPUT_FILE = 'data/tmetric_processed.csv'
 
 
 # Global threshold for holiday/worked weekend (in hours)
 DAILY_THRESHOLD = 2.0  # hours
 
-def get_holidays_by_year(input_file, year, threshold=DAILY_THRESHOLD):
-    # Map date -> total hours
-    day_hours = defaultdict(float)
-    with open(input_file, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            day = row.get('parsed_day') or row.get('Day')
-            if not day:
-                continue
-            try:
-                date_obj = datetime.datetime.strptime(day, '%Y-%m-%d').date()
-            except Exception:
-                try:
-                    date_obj = datetime.datetime.strptime(day, '%d/%m/%Y').date()
-                except Exception:
-                    continue
-            if date_obj.year != year:
+# Increase when the drawing code changes, so images rendered by the old code are not taken from the render cache
+RENDER_VERSION = 1
+
+def get_day_hours(input_file, year=None, timezones=None):
+    # Map date -> total hours (of one year, or of all years if year is None),
+    # in the reporting zone of timezones (a timezones.TimezoneConfig) if given
+    return tmetric_io.day_hours(input_file, year, timezones=timezones)
+
+
+class ThresholdSweep(object):
+    '''
+    classifies the days of one year for any threshold: workdays with less than threshold hours (or missing) are
+    holidays, weekend days with at least threshold hours are worked weekends.
+    The hours are sorted once, after that every threshold costs O(log n) (plus the size of the sets, if requested)
+    '''
+    def __init__(self, day_hours, year):
+        # Build set of all days in the year
+        today = datetime.date.today()
+        all_days = [datetime.date(year, 1, 1) + datetime.timedelta(days=i) for i in range((datetime.date(year+1, 1, 1) - datetime.date(year, 1, 1)).days)]
+        workdays = []
+        weekend_days = []
+        for date_obj in all_days:
+            # For the current year, skip future days
+            if year == today.year and date_obj > today:
                 continue
-            hours = float(row.get('Duration adjusted (hours)', 0))
-            day_hours[date_obj] += hours
-    # Build set of all days in the year
-    today = datetime.date.today()
-    all_days = [datetime.date(year, 1, 1) + datetime.timedelta(days=i) for i in range((datetime.date(year+1, 1, 1) - datetime.date(year, 1, 1)).days)]
-    workday_holidays = set()
-    weekend_worked = set()
-    for date_obj in all_days:
-        # For the current year, skip future days
-        if year == today.year and date_obj > today:
-            continue
-        hours = day_hours.get(date_obj, 0.0)
-        wd = date_obj.weekday()
-        if wd < 5:
-            # Weekday: less than threshold hours or missing is a holiday
-            if hours < threshold:
-                workday_holidays.add(date_obj)
+            hours = day_hours.get(date_obj, 0.0)
+            if date_obj.weekday() < 5:
+                workdays.append((hours, date_obj))
+            else:
+                weekend_days.append((hours, date_obj))
+        workdays.sort()
+        weekend_days.sort()
+        self.year = year
+        self.workday_hours = [hours for hours, _ in workdays]
+        self.workdays = [date_obj for _, date_obj in workdays]
+        self.weekend_hours = [hours for hours, _ in weekend_days]
+        self.weekend_days = [date_obj for _, date_obj in weekend_days]
+
+    def counts(self, threshold):
+        # number of workday holidays and worked weekends
+        n_holidays = bisect.bisect_left(self.workday_hours, threshold)
+        n_weekends = len(self.weekend_hours) - bisect.bisect_left(self.weekend_hours, threshold)
+        return n_holidays, n_weekends
+
+    def days(self, threshold):
+        # sets of workday holidays and worked weekends
+        n_holidays = bisect.bisect_left(self.workday_hours, threshold)
+        first_weekend = bisect.bisect_left(self.weekend_hours, threshold)
+        return set(self.workdays[:n_holidays]), set(self.weekend_days[first_weekend:])
+
+
+def sweep_thresholds(day_hours, years, thresholds, return_days=False):
+    """
+    counts workday holidays and worked weekends per year for every threshold
+    :param day_hours: dict date -> hours, see get_day_hours
+    :param years: list of years
+    :param thresholds: list of thresholds (in hours)
+    :param return_days: also return the sets of days
+    :return: dict year -> list with per threshold (n_holidays, n_weekends) or (holidays, weekends) if return_days
+    """
+    result = {}
+    for year in years:
+        sweep = ThresholdSweep(day_hours, year)
+        if return_days:
+            result[year] = [sweep.days(t) for t in thresholds]
         else:
-            # Weekend: more than threshold hours is a 'worked weekend'
-            if hours >= threshold:
-                weekend_worked.add(date_obj)
-    return workday_holidays, weekend_worked
+            result[year] = [sweep.counts(t) for t in thresholds]
+    return result
+
 
-def plot_holiday_calendar(year, workday_holidays, weekend_worked):
+def get_holidays_by_year(input_file, year, threshold=DAILY_THRESHOLD, timezones=None):
+    return ThresholdSweep(get_day_hours(input_file, year, timezones), year).days(threshold)
+
+
+def plot_threshold_sensitivity(counts, thresholds):
+    # counts as returned by sweep_thresholds: one line per year for holidays (solid) and worked weekends (dashed)
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    for year, year_counts in counts.items():
+        line, = ax1.plot(thresholds, [c[0] for c in year_counts], label=str(year))
+        ax2.plot(thresholds, [c[1] for c in year_counts], label=str(year), color=line.get_color(), linestyle='--')
+    for ax, title in [(ax1, 'Workday holidays (< threshold)'), (ax2, 'Worked weekend days (>= threshold)')]:
+        ax.axvline(DAILY_THRESHOLD, color='gray', linestyle=':', label=f'DAILY_THRESHOLD ({DAILY_THRESHOLD}h)')
+        ax.set_xlabel('Threshold (hours)')
+        ax.set_ylabel('Number of days')
+        ax.set_title(title)
+        ax.grid(linestyle='--', alpha=0.7)
+    ax2.legend(fontsize='small')
+    plt.tight_layout()
+    os.makedirs('plots', exist_ok=True)
+    plt.savefig('plots/threshold_sensitivity.png')
+    plt.show()
+
+
+def threshold_sensitivity(input_file=INPUT_FILE, thresholds=None, timezones=None):
+    # Read the data once, then classify the days for every threshold
+    if thresholds is None:
+        thresholds = [t / 4 for t in range(0, 4 * 8 + 1)]  # 0h to 8h in steps of 15 minutes
+    day_hours = get_day_hours(input_file, timezones=timezones)
+    years = sorted({d.year for d in day_hours if d.year >= 2019})
+    counts = sweep_thresholds(day_hours, years, thresholds)
+    for year in years:
+        print(f"Year {year}: " + ', '.join(f"{t}h: {h}/{w}" for t, (h, w) in zip(thresholds, counts[year])))
+    plot_threshold_sensitivity(counts, thresholds)
+    return counts
+
+def plot_holiday_calendar(year, workday_holidays, weekend_worked, force=False):
+    output = f'plots/holiday_calendar_{year}.png'
+    # the calendar only shows which days are green or red
+    marks = dict.fromkeys(workday_holidays, 'holiday')
+    marks.update(dict.fromkeys(weekend_worked, 'weekend'))
+    key = render_cache.render_key(marks, threshold=DAILY_THRESHOLD, version=RENDER_VERSION)
+    if not force and render_cache.is_fresh(output, key):
+        # same marks as the existing image: show that one instead of drawing it again
+        fig, ax = plt.subplots(figsize=(18, 12))
+        ax.imshow(plt.imread(output))
+        ax.axis('off')
+        plt.tight_layout()
+        plt.show()
+        return
     # Create a calendar for the year, mark holidays and worked weekends
     months = range(1, 13)
     fig, axes = plt.subplots(3, 4, figsize=(18, 12))
@@ -102,35 +183,21 @@ def plot_holiday_calendar(year, workday_holidays, weekend_worked):
     plt.suptitle(f"Holiday Calendar {year}", fontsize=18)
     plt.tight_layout(rect=[0, 0, 1, 0.96])
     os.makedirs('plots', exist_ok=True)
-    plt.savefig(f'plots/holiday_calendar_{year}.png')
+    plt.savefig(output)
+    render_cache.record(output, key)
     plt.show()
 
 def main():
-    # Compute and plot statistics for all years in the data
-    # First, find all years present in the data
-    years = set()
-    with open(INPUT_FILE, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            day = row.get('parsed_day') or row.get('Day')
-            if not day:
-                continue
-            try:
-                date_obj = datetime.datetime.strptime(day, '%Y-%m-%d').date()
-            except Exception:
-                try:
-                    date_obj = datetime.datetime.strptime(day, '%d/%m/%Y').date()
-                except Exception:
-                    continue
-            years.add(date_obj.year)
-    years = sorted([y for y in years if y >= 2019])
+    # Compute and plot statistics for all years in the data (from 2019), from the rollup cube of the export
+    day_hours = rollup_cube.calendar_day_hours(INPUT_FILE, TimezoneConfig.configured())
+    years = sorted({d.year for d in day_hours if d.year >= 2019})
 
     green_counts = []
     red_counts = []
     green_per_year = []
     red_per_year = []
     for year in years:
-        workday_holidays, weekend_worked = get_holidays_by_year(INPUT_FILE, year, DAILY_THRESHOLD)
+        workday_holidays, weekend_worked = ThresholdSweep(day_hours, year).days(DAILY_THRESHOLD)
         print(f"Year {year}: Green (workday holidays) = {len(workday_holidays)}, Red (worked weekends) = {len(weekend_worked)}")
         green_counts.append(len(workday_holidays))
         red_counts.append(len(weekend_worked))
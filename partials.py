@@ -0,0 +1,185 @@
+import csv
+import datetime
+import functools
+import itertools
+import json
+import sys
+from collections import Counter
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from tmetric_io import PIPELINE_DAYFIRST, PIPELINE_YEARFIRST, open_text, parse_day, parse_duration, row_tags, csv_header, compression, split_chunks, \
+    mmap_columns
+
+
+EMAIL_PROJECT = 'Email (various)'  # see process_tmetric_email_adjusted.PROJECT_NAME
+
+# the columns read by PartialAggregate.add_row
+COLUMNS = ('Day', 'parsed_day', 'Duration', 'Project', 'Duration adjusted (hours)', 'Work Type', 'Project Code')
+
+# the counters of a PartialAggregate
+FIELDS = ('day_seconds', 'adjusted_day_seconds', 'week_seconds', 'week_email_seconds', 'tag_seconds')
+
+
+def _row_day(row: dict) -> datetime.date:
+    # the raw Day is parsed as the email adjusted pipeline parses it into parsed_day, so raw and processed files
+    # give the same days
+    if row.get('parsed_day'):
+        return datetime.date.fromisoformat(row['parsed_day'])
+    return parse_day(row['Day'], PIPELINE_DAYFIRST, PIPELINE_YEARFIRST)
+
+
+class PartialAggregate(object):
+    '''
+    aggregates of (a part of) the tmetric data that can be computed per file and merged afterwards.
+    All values are integer seconds, so merging is exact, associative and commutative:
+    day_seconds: day ordinal -> seconds worked (Duration column)
+    adjusted_day_seconds: day ordinal -> seconds of 'Duration adjusted (hours)' (processed files only)
+    week_seconds, week_email_seconds: ordinal of Monday -> seconds worked in total / on email
+    tag_seconds: (year, tag) -> seconds, tags as in Work.plot_tags_pie
+    '''
+    def __init__(self) -> None:
+        for field in FIELDS:
+            setattr(self, field, Counter())
+
+    def add_row(self, row: dict) -> None:
+        day = _row_day(row).toordinal()
+        seconds = parse_duration(row['Duration'])
+        week = day - (day - 1) % 7
+        self.day_seconds[day] += seconds
+        self.week_seconds[week] += seconds
+        if row.get('Project') == EMAIL_PROJECT:
+            self.week_email_seconds[week] += seconds
+        if row.get('Duration adjusted (hours)'):
+            self.adjusted_day_seconds[day] += round(float(row['Duration adjusted (hours)']) * 3600)
+        year = datetime.date.fromordinal(day).year
+        for tag in row_tags(row):
+            self.tag_seconds[(year, tag)] += seconds
+
+    def merge(self, other: 'PartialAggregate') -> 'PartialAggregate':
+        """
+        returns a new aggregate combining self and other
+        """
+        merged = PartialAggregate()
+        for field in FIELDS:
+            counter = getattr(merged, field)
+            counter.update(getattr(self, field))
+            counter.update(getattr(other, field))
+        return merged
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PartialAggregate) and all(
+            getattr(self, field) == getattr(other, field) for field in FIELDS)
+
+    def to_json(self) -> str:
+        data = {field: [[list(key) if isinstance(key, tuple) else key, value]
+                        for key, value in sorted(getattr(self, field).items())]
+                for field in FIELDS}
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, text: str) -> 'PartialAggregate':
+        partial = cls()
+        for field, items in json.loads(text).items():
+            getattr(partial, field).update({tuple(key) if isinstance(key, list) else key: value
+                                            for key, value in items})
+        return partial
+
+    def hours_per_day(self, adjusted: bool = False) -> dict:
+        """
+        :param adjusted: use the email adjusted durations
+        :return: dict with keys: dates, values: hours
+        """
+        day_seconds = self.adjusted_day_seconds if adjusted else self.day_seconds
+        return {datetime.date.fromordinal(day): seconds / 3600 for day, seconds in sorted(day_seconds.items())}
+
+    def hours_per_tag(self, year: int) -> dict:
+        return {tag: seconds / 3600 for (tag_year, tag), seconds in self.tag_seconds.items() if tag_year == year}
+
+    def weekly_email(self) -> dict:
+        """
+        :return: dict Monday -> (email hours, total hours, email fraction), like the weekly columns of
+        process_tmetric_email_adjusted
+        """
+        result = {}
+        for week, seconds in sorted(self.week_seconds.items()):
+            email = self.week_email_seconds.get(week, 0)
+            result[datetime.date.fromordinal(week)] = (email / 3600, seconds / 3600, email / seconds if seconds else 0)
+        return result
+
+    def weekday_histograms(self, bins=range(0, 20), adjusted: bool = True) -> dict:
+        """
+        histograms of the hours per worked day, like histogram_hours_per_workday.py
+        :return: dict 'weekday' (Mon-Fri), 'saturday', 'sunday' -> counts per bin
+        """
+        day_seconds = self.adjusted_day_seconds if adjusted and self.adjusted_day_seconds else self.day_seconds
+        days = np.fromiter(day_seconds.keys(), dtype=np.int64, count=len(day_seconds))
+        hours = np.fromiter(day_seconds.values(), dtype=float, count=len(day_seconds)) / 3600
+        weekdays = (days - 1) % 7
+        groups = {'weekday': weekdays < 5, 'saturday': weekdays == 5, 'sunday': weekdays == 6}
+        return {name: np.histogram(hours[mask], bins=list(bins))[0] for name, mask in groups.items()}
+
+
+def partial_from_rows(rows) -> PartialAggregate:
+    partial = PartialAggregate()
+    for row in rows:
+        partial.add_row(row)
+    return partial
+
+
+def _read_rows(filename: str):
+    with open_text(filename, encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def partial_from_file(filename: str) -> PartialAggregate:
+    return partial_from_rows(_read_rows(filename))
+
+
+def partial_from_chunk(filename: str, start: int, end: int) -> PartialAggregate:
+    """
+    computes the partial aggregate of the records between the byte offsets start and end (see
+    tmetric_io.split_chunks), reading only COLUMNS
+    """
+    columns = [column for column in COLUMNS if column in csv_header(filename)]
+    return partial_from_rows(dict(zip(columns, values)) for values in mmap_columns(filename, columns, start, end))
+
+
+def merge_all(partials) -> PartialAggregate:
+    return functools.reduce(PartialAggregate.merge, partials, PartialAggregate())
+
+
+def compute_partials(filenames, processes: int = None) -> PartialAggregate:
+    """
+    computes the partial aggregate of every file in its own process and merges them
+    """
+    with Pool(processes) as pool:
+        return merge_all(pool.map(partial_from_file, filenames))
+
+
+def compute_partials_chunked(filename: str, processes: int = None) -> PartialAggregate:
+    """
+    splits one (uncompressed) file into newline aligned chunks, computes their partial aggregates in parallel and
+    merges them
+    """
+    if compression(filename):
+        return partial_from_file(filename)
+    chunks = split_chunks(filename, processes or cpu_count())
+    with Pool(processes) as pool:
+        return merge_all(pool.starmap(partial_from_chunk, [(filename, start, end) for start, end in chunks]))
+
+
+def main():
+    filenames = sys.argv[1:] or ['data/tmetric.csv']
+    merged = compute_partials(filenames)
+    single = partial_from_rows(itertools.chain.from_iterable(_read_rows(f) for f in filenames))
+    print('merged result identical to single process run: {}'.format(merged == single))
+    shipped = merge_all(PartialAggregate.from_json(partial_from_file(f).to_json()) for f in reversed(filenames))
+    print('merged result identical after json round trip (reversed order): {}'.format(shipped == single))
+    chunked = merge_all(compute_partials_chunked(f) for f in filenames)
+    print('merged result identical when splitting the files in chunks: {}'.format(chunked == single))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import datetime
+
+import numpy as np
+
+
+# ordinal of 1 Jan 1970, the epoch of numpy's datetime64
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# first month of the academic year
+ACADEMIC_YEAR_START_MONTH = 9
+
+PERIODS = ('day', 'weekday', 'week', 'iso_week', 'month', 'quarter', 'year', 'academic_year')
+
+
+def weekday(day: datetime.date) -> int:
+    """
+    returns the numerical weekday of day (Monday: 1, ..., Sunday: 7)
+    """
+    return day.isoweekday()
+
+
+def weeknr(day: datetime.date) -> int:
+    """
+    returns the ISO number of the week
+    :param day:
+    :return:
+    """
+    return day.isocalendar()[1]
+
+
+def week_start(day: datetime.date) -> datetime.date:
+    """
+    returns the date Monday of the same week as day
+    :param day: datetime.date
+    :return:
+    """
+    return day - datetime.timedelta(days=day.weekday())  # the date of Monday of that week
+
+
+def academic_year(day: datetime.date) -> int:
+    """
+    returns the academic year of day, as the calendar year in which it starts (2018 for 2018-2019)
+    """
+    return day.year if day.month >= ACADEMIC_YEAR_START_MONTH else day.year - 1
+
+
+class CalendarTable(object):
+    '''
+    lookup table mapping every day of a date range to its weekday, week, month, quarter, (academic) year,
+    indexed by day ordinal - first ordinal
+    '''
+    def __init__(self, start_date: datetime.date, end_date: datetime.date) -> None:
+        """
+        computes the table for all days from start_date to end_date inclusive
+        :param start_date: datetime.date
+        :param end_date: datetime.date
+        """
+        self.first = start_date.toordinal()
+        self.last = end_date.toordinal()
+        ordinals = np.arange(self.first, self.last + 1)
+        self.ordinal = ordinals
+        self.weekday = (ordinals - 1) % 7 + 1  # ordinal 1 (1 Jan 0001) is a Monday
+        self.week_start = ordinals - (self.weekday - 1)
+
+        days = (ordinals - EPOCH_ORDINAL).astype('datetime64[D]')
+        self.year = days.astype('datetime64[Y]').astype(np.int64) + 1970
+        self.month = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+        self.quarter = (self.month - 1) // 3 + 1
+        self.academic_year = np.where(self.month >= ACADEMIC_YEAR_START_MONTH, self.year, self.year - 1)
+
+        # the ISO week belongs to the year of its Thursday
+        thursdays = self.week_start + 3
+        thursday_days = (thursdays - EPOCH_ORDINAL).astype('datetime64[D]')
+        thursday_years = thursday_days.astype('datetime64[Y]')
+        self.iso_year = thursday_years.astype(np.int64) + 1970
+        jan1 = thursday_years.astype('datetime64[D]')
+        self.iso_week = (thursday_days - jan1).astype(np.int64) // 7 + 1
+
+    def __len__(self) -> int:
+        return len(self.ordinal)
+
+    def __contains__(self, day: datetime.date) -> bool:
+        return self.first <= day.toordinal() <= self.last
+
+    def codes(self, period: str) -> np.ndarray:
+        """
+        returns one integer per day identifying its period, see decode
+        :param period: one of PERIODS
+        :return: np.ndarray of int
+        """
+        if period == 'day':
+            return self.ordinal
+        if period == 'weekday':
+            return self.weekday
+        if period == 'week':
+            return self.week_start
+        if period == 'iso_week':
+            return self.iso_year * 100 + self.iso_week
+        if period == 'month':
+            return self.year * 12 + self.month - 1
+        if period == 'quarter':
+            return self.year * 4 + self.quarter - 1
+        if period == 'year':
+            return self.year
+        if period == 'academic_year':
+            return self.academic_year
+        raise ValueError('unknown period {!r}, use one of {}'.format(period, ', '.join(PERIODS)))
+
+    @staticmethod
+    def decode(period: str, code: int):
+        """
+        turns a code as returned by codes() into a readable key:
+        day and week: datetime.date (the Monday for week), iso_week: (iso year, week number),
+        month: (year, month), quarter: (year, quarter), weekday, year and academic_year: int
+        """
+        code = int(code)
+        if period in ('day', 'week'):
+            return datetime.date.fromordinal(code)
+        if period == 'iso_week':
+            return divmod(code, 100)
+        if period == 'month':
+            year, month = divmod(code, 12)
+            return year, month + 1
+        if period == 'quarter':
+            year, quarter = divmod(code, 4)
+            return year, quarter + 1
+        return code
+
+    def lookup(self, period: str, ordinals: np.ndarray) -> np.ndarray:
+        """
+        returns the period codes of an array of day ordinals
+        :param period: one of PERIODS
+        :param ordinals: np.ndarray of day ordinals between first and last
+        :return: np.ndarray of int
+        """
+        return self.codes(period)[ordinals - self.first]
+
+
+def dense_hours(day_hours, start_date: datetime.date, end_date: datetime.date) -> np.ndarray:
+    """
+    returns the hours of every day from start_date to end_date inclusive as an array, days missing in day_hours are 0
+    :param day_hours: dict with keys: dates, values: hours (float) or timedelta
+    :param start_date: datetime.date
+    :param end_date: datetime.date
+    :return: np.ndarray of float
+    """
+    first = start_date.toordinal()
+    hours = np.zeros(end_date.toordinal() - first + 1)
+    if not day_hours:
+        return hours
+    ordinals = np.fromiter((day.toordinal() for day in day_hours), dtype=np.int64, count=len(day_hours))
+    values = np.fromiter((v.total_seconds() / 3600 if isinstance(v, datetime.timedelta) else v
+                          for v in day_hours.values()), dtype=float, count=len(day_hours))
+    index = ordinals - first
+    inside = (index >= 0) & (index < len(hours))
+    hours[index[inside]] = values[inside]
+    return hours
+
+
+def week_range(start_date: datetime.date, end_date: datetime.date):
+    """
+    returns the Monday of the week of start_date and the Sunday of the week of end_date
+    """
+    first = week_start(start_date)
+    return first, week_start(end_date) + datetime.timedelta(days=6)
+
+
+def week_matrix(day_hours, start_date: datetime.date, end_date: datetime.date):
+    """
+    arranges the hours of all weeks from the week of start_date to the week of end_date in a (weeks x 7) matrix
+    :param day_hours: dict with keys: dates, values: hours (float) or timedelta, or a dense array with the hours of
+    every day from week_range(start_date, end_date)
+    :param start_date: datetime.date
+    :param end_date: datetime.date
+    :return: tuple (matrix with one row Monday-Sunday per week, ISO week numbers, hours per week)
+    """
+    first, last = week_range(start_date, end_date)
+    if not isinstance(day_hours, np.ndarray):
+        day_hours = dense_hours(day_hours, first, last)
+    matrix = day_hours.reshape(-1, 7)
+    week_labels = CalendarTable(first, last).iso_week[::7]
+    return matrix, week_labels, matrix.sum(axis=1)
@@ -1,150 +1,285 @@
-
 import csv
 import datetime
-from dateutil.parser import parse
+import hashlib
+import json
+import os
+import sys
 from collections import defaultdict
 
 # For Excel export
 import xlsxwriter
 
+from periods import week_start
+import rollup_cube
+import tmetric_io
+
 INPUT_FILE = 'data/tmetric.csv'
 OUTPUT_FILE = 'data/tmetric_processed.csv'
+# per week fingerprints of the input of the last run, for incremental runs
+STATE_FILE = 'data/tmetric_processed.state.json'
 PROJECT_NAME = 'Email (various)'
 
-# Helper to get week start (Monday)
-def week_start(day: datetime.date) -> datetime.date:
-    return day - datetime.timedelta(days=day.weekday())
+EXTRA_COLUMNS = [
+    'Duration adjusted', 'Weekly Email Total', 'Weekly Email %', 'Year', 'Month', 'Week', 'Weekly Total',
+    'Duration adjusted (hours)', 'Weekly Email Total (hours)', 'Weekly Total (hours)']
+NUMERIC_COLUMNS = {'Year', 'Month', 'Week', 'Duration adjusted (hours)', 'Weekly Email Total (hours)', 'Weekly Total (hours)'}
 
 def parse_duration(duration_str):
     # Handles HH:MM or H:MM
-    t = parse(duration_str)
-    return datetime.timedelta(hours=t.hour, minutes=t.minute)
+    return datetime.timedelta(seconds=tmetric_io.parse_duration(duration_str))
 
-def main():
-    # Read all rows and parse dates/durations
+def read_rows(input_file):
+    # Read all rows and parse dates/durations, also returns the fingerprint of every row's raw values
     rows = []
-    with open(INPUT_FILE, newline='', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            row['parsed_day'] = parse(row['Day'], yearfirst=True, dayfirst=False).date()
-            row['parsed_duration'] = parse_duration(row['Duration'])
-            rows.append(row)
-
-    # Group by week
+    fingerprints = []
+    input_fieldnames = tmetric_io.csv_header(input_file)
+    for values in tmetric_io.mmap_columns(input_file, input_fieldnames):
+        row = dict(zip(input_fieldnames, values))
+        fingerprints.append('\x1f'.join(values))
+        row['parsed_day'] = tmetric_io.parse_day(row['Day'], dayfirst=tmetric_io.PIPELINE_DAYFIRST,
+                                                yearfirst=tmetric_io.PIPELINE_YEARFIRST)
+        row['parsed_duration'] = parse_duration(row['Duration'])
+        rows.append(row)
+    return rows, fingerprints, input_fieldnames
+
+def group_by_week(rows):
     week_to_rows = defaultdict(list)
     for row in rows:
         ws = week_start(row['parsed_day'])
         week_to_rows[ws].append(row)
+    return week_to_rows
 
-    # For each week, compute total duration and email duration
-    for week, week_rows in week_to_rows.items():
+def week_fingerprints(rows, fingerprints):
+    # one hash per week of the raw values of all its rows (in order)
+    hashes = defaultdict(hashlib.sha1)
+    for row, fingerprint in zip(rows, fingerprints):
+        hashes[week_start(row['parsed_day']).isoformat()].update(fingerprint.encode() + b'\x1e')
+    return {week: h.hexdigest() for week, h in hashes.items()}
+
+def adjust_week(week, week_rows, weekly_email=None):
+    # add the adjusted columns to the rows of a week, using the weekly (email seconds, total seconds) of the rollup
+    # cube if given (see rollup_cube.RollupCube.weekly_email), else summing them over the rows
+    if weekly_email is not None:
+        email_duration, total_duration = (datetime.timedelta(seconds=s) for s in weekly_email)
+    else:
         total_duration = sum((r['parsed_duration'] for r in week_rows), datetime.timedelta())
-        email_duration = sum((r['parsed_duration'] for r in week_rows if r['Project'] == PROJECT_NAME), datetime.timedelta())
-        # Compute email percentage
-        total_seconds = total_duration.total_seconds()
-        email_seconds = email_duration.total_seconds()
-        email_pct = email_seconds / total_seconds if total_seconds > 0 else 0
-        # Format email_duration as h:mm:ss
-        email_hours = int(email_seconds // 3600)
-        email_minutes = int((email_seconds % 3600) // 60)
-        email_seconds_rem = int(email_seconds % 60)
-        email_duration_str = f"{email_hours:02d}:{email_minutes:02d}:{email_seconds_rem:02d}"
-        email_pct_str = f"{email_pct:.4f}" if total_seconds > 0 else "0.0000"
-        # Format total_duration as h:mm:ss
-        total_hours = int(total_seconds // 3600)
-        total_minutes = int((total_seconds % 3600) // 60)
-        total_seconds_rem = int(total_seconds % 60)
-        total_duration_str = f"{total_hours:02d}:{total_minutes:02d}:{total_seconds_rem:02d}"
-        # Get year, month, week number from week start
-        year = week.year
-        month = week.month
-        week_number = week.isocalendar()[1]
-        # Add adjusted duration and all stats to each row, including numeric columns for easier import
-        adjusted_seconds_list = []
-        orig_seconds_list = []
-        # Calculate total non-email duration for proportional distribution
-        non_email_rows = [r for r in week_rows if r['Project'] != PROJECT_NAME]
-        total_non_email_seconds = sum(r['parsed_duration'].total_seconds() for r in non_email_rows)
-        if total_non_email_seconds == 0:
-            # Only email activities this week: do not adjust, keep original durations
-            for r in week_rows:
-                orig_seconds = r['parsed_duration'].total_seconds()
-                adjusted_seconds = orig_seconds
-                adjusted_seconds_list.append(adjusted_seconds)
-                orig_seconds_list.append(orig_seconds)
-                hours = int(adjusted_seconds // 3600)
-                minutes = int((adjusted_seconds % 3600) // 60)
-                seconds = int(adjusted_seconds % 60)
-                r['Duration adjusted'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                r['Weekly Email Total'] = email_duration_str
-                r['Weekly Email %'] = email_pct_str
-                r['Year'] = year
-                r['Month'] = month
-                r['Week'] = week_number
-                r['Weekly Total'] = total_duration_str
-                # Numeric columns for Apple Numbers/Excel
-                r['Duration adjusted (hours)'] = round(adjusted_seconds / 3600, 4)
-                r['Weekly Email Total (hours)'] = round(email_duration.total_seconds() / 3600, 4)
-                r['Weekly Total (hours)'] = round(total_seconds / 3600, 4)
-        else:
-            for r in week_rows:
-                orig_seconds = r['parsed_duration'].total_seconds()
-                orig_seconds_list.append(orig_seconds)
-                if r['Project'] == PROJECT_NAME:
-                    # Email time is not distributed to itself, set adjusted to 0
-                    adjusted_seconds = 0
-                else:
-                    # Distribute email time proportionally to non-email activities
-                    share = (orig_seconds / total_non_email_seconds)
-                    adjusted_seconds = orig_seconds + share * email_seconds
-                adjusted_seconds_list.append(adjusted_seconds)
-                hours = int(adjusted_seconds // 3600)
-                minutes = int((adjusted_seconds % 3600) // 60)
-                seconds = int(adjusted_seconds % 60)
-                r['Duration adjusted'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                r['Weekly Email Total'] = email_duration_str
-                r['Weekly Email %'] = email_pct_str
-                r['Year'] = year
-                r['Month'] = month
-                r['Week'] = week_number
-                r['Weekly Total'] = total_duration_str
-                # Numeric columns for Apple Numbers/Excel
-                r['Duration adjusted (hours)'] = round(adjusted_seconds / 3600, 4)
-                r['Weekly Email Total (hours)'] = round(email_duration.total_seconds() / 3600, 4)
-                r['Weekly Total (hours)'] = round(total_seconds / 3600, 4)
-            # Double check: weekly sum of original and adjusted durations should be the same (within rounding)
-            orig_sum = sum(orig_seconds_list)
-            adj_sum = sum(adjusted_seconds_list)
-            if abs(orig_sum - adj_sum) > 1:  # allow 1 second tolerance
-                print(f"WARNING: Week {year}-W{week_number:02d} sum mismatch: original={orig_sum:.2f}s, adjusted={adj_sum:.2f}s")
+        email_duration = sum((r['parsed_duration'] for r in week_rows if r['Project'] == PROJECT_NAME),
+                             datetime.timedelta())
+    # Compute email percentage
+    total_seconds = total_duration.total_seconds()
+    email_seconds = email_duration.total_seconds()
+    email_pct = email_seconds / total_seconds if total_seconds > 0 else 0
+    # Format email_duration as h:mm:ss
+    email_hours = int(email_seconds // 3600)
+    email_minutes = int((email_seconds % 3600) // 60)
+    email_seconds_rem = int(email_seconds % 60)
+    email_duration_str = f"{email_hours:02d}:{email_minutes:02d}:{email_seconds_rem:02d}"
+    email_pct_str = f"{email_pct:.4f}" if total_seconds > 0 else "0.0000"
+    # Format total_duration as h:mm:ss
+    total_hours = int(total_seconds // 3600)
+    total_minutes = int((total_seconds % 3600) // 60)
+    total_seconds_rem = int(total_seconds % 60)
+    total_duration_str = f"{total_hours:02d}:{total_minutes:02d}:{total_seconds_rem:02d}"
+    # Get year, month, week number from week start
+    year = week.year
+    month = week.month
+    week_number = week.isocalendar()[1]
+    # Add adjusted duration and all stats to each row, including numeric columns for easier import
+    adjusted_seconds_list = []
+    orig_seconds_list = []
+    # Calculate total non-email duration for proportional distribution
+    non_email_rows = [r for r in week_rows if r['Project'] != PROJECT_NAME]
+    total_non_email_seconds = sum(r['parsed_duration'].total_seconds() for r in non_email_rows)
+    if total_non_email_seconds == 0:
+        # Only email activities this week: do not adjust, keep original durations
+        for r in week_rows:
+            orig_seconds = r['parsed_duration'].total_seconds()
+            adjusted_seconds = orig_seconds
+            adjusted_seconds_list.append(adjusted_seconds)
+            orig_seconds_list.append(orig_seconds)
+            hours = int(adjusted_seconds // 3600)
+            minutes = int((adjusted_seconds % 3600) // 60)
+            seconds = int(adjusted_seconds % 60)
+            r['Duration adjusted'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+            r['Weekly Email Total'] = email_duration_str
+            r['Weekly Email %'] = email_pct_str
+            r['Year'] = year
+            r['Month'] = month
+            r['Week'] = week_number
+            r['Weekly Total'] = total_duration_str
+            # Numeric columns for Apple Numbers/Excel
+            r['Duration adjusted (hours)'] = round(adjusted_seconds / 3600, 4)
+            r['Weekly Email Total (hours)'] = round(email_duration.total_seconds() / 3600, 4)
+            r['Weekly Total (hours)'] = round(total_seconds / 3600, 4)
+    else:
+        for r in week_rows:
+            orig_seconds = r['parsed_duration'].total_seconds()
+            orig_seconds_list.append(orig_seconds)
+            if r['Project'] == PROJECT_NAME:
+                # Email time is not distributed to itself, set adjusted to 0
+                adjusted_seconds = 0
+            else:
+                # Distribute email time proportionally to non-email activities
+                share = (orig_seconds / total_non_email_seconds)
+                adjusted_seconds = orig_seconds + share * email_seconds
+            adjusted_seconds_list.append(adjusted_seconds)
+            hours = int(adjusted_seconds // 3600)
+            minutes = int((adjusted_seconds % 3600) // 60)
+            seconds = int(adjusted_seconds % 60)
+            r['Duration adjusted'] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+            r['Weekly Email Total'] = email_duration_str
+            r['Weekly Email %'] = email_pct_str
+            r['Year'] = year
+            r['Month'] = month
+            r['Week'] = week_number
+            r['Weekly Total'] = total_duration_str
+            # Numeric columns for Apple Numbers/Excel
+            r['Duration adjusted (hours)'] = round(adjusted_seconds / 3600, 4)
+            r['Weekly Email Total (hours)'] = round(email_duration.total_seconds() / 3600, 4)
+            r['Weekly Total (hours)'] = round(total_seconds / 3600, 4)
+        # Double check: weekly sum of original and adjusted durations should be the same (within rounding)
+        orig_sum = sum(orig_seconds_list)
+        adj_sum = sum(adjusted_seconds_list)
+        if abs(orig_sum - adj_sum) > 1:  # allow 1 second tolerance
+            print(f"WARNING: Week {year}-W{week_number:02d} sum mismatch: original={orig_sum:.2f}s, adjusted={adj_sum:.2f}s")
 
-    # Write output
+def output_fieldnames(rows):
     fieldnames = list(rows[0].keys())
-    for extra_col in [
-        'Duration adjusted', 'Weekly Email Total', 'Weekly Email %', 'Year', 'Month', 'Week', 'Weekly Total',
-        'Duration adjusted (hours)', 'Weekly Email Total (hours)', 'Weekly Total (hours)']:
+    for extra_col in EXTRA_COLUMNS:
         if extra_col not in fieldnames:
             fieldnames.append(extra_col)
+    return fieldnames
 
-    # Write CSV
-    with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
+def write_csv(output_file, fieldnames, rows):
+    # rows are dicts or lists of values in the order of fieldnames, compressed if output_file ends with .gz/.bz2/.xz
+    with tmetric_io.open_text(output_file, 'w', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
         for row in rows:
+            if isinstance(row, dict):
+                row = [row.get(field, '') for field in fieldnames]
             writer.writerow(row)
 
-    # Write Excel
-    excel_file = OUTPUT_FILE.replace('.csv', '.xlsx')
+def excel_filename(output_file):
+    return tmetric_io.strip_compression(output_file).replace('.csv', '.xlsx')
+
+def write_excel(output_file, fieldnames, rows):
+    excel_file = excel_filename(output_file)
     workbook = xlsxwriter.Workbook(excel_file)
     worksheet = workbook.add_worksheet('Sheet1')
     # Write header
     for col, field in enumerate(fieldnames):
         worksheet.write(0, col, field)
     # Write data
+    numeric = [field in NUMERIC_COLUMNS for field in fieldnames]
     for row_idx, row in enumerate(rows, 1):
-        for col, field in enumerate(fieldnames):
-            worksheet.write(row_idx, col, row.get(field, ''))
+        if isinstance(row, dict):
+            row = [row.get(field, '') for field in fieldnames]
+        else:
+            # values copied from the previous CSV output are strings
+            row = [float(value) if is_numeric and value else value for value, is_numeric in zip(row, numeric)]
+        for col, value in enumerate(row):
+            worksheet.write(row_idx, col, value)
     workbook.close()
 
+def load_state(state_file):
+    try:
+        with open(state_file, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def output_identity(output_file):
+    # identifies the output file a state belongs to, and the version of it that was written
+    st = os.stat(output_file)
+    return {'path': os.path.abspath(output_file), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def week_order(rows):
+    # fingerprint of the week of every row, in input order: the output follows it
+    return hashlib.sha1(' '.join(week_start(row['parsed_day']).isoformat() for row in rows).encode()).hexdigest()
+
+def save_state(state_file, input_fieldnames, fieldnames, weeks, order, output_file):
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump({'input_fieldnames': input_fieldnames, 'fieldnames': fieldnames, 'weeks': weeks, 'order': order,
+                   'output': output_identity(output_file)}, f)
+
+def read_previous_output(output_file, fieldnames):
+    # processed rows of the previous run as lists of strings, grouped by week
+    week_to_values = defaultdict(list)
+    with tmetric_io.open_text(output_file, encoding='utf-8') as f:
+        reader = csv.reader(f)
+        if next(reader, None) != fieldnames:
+            return None
+        day_col = fieldnames.index('parsed_day')
+        for values in reader:
+            day = datetime.date.fromisoformat(values[day_col])
+            week_to_values[week_start(day).isoformat()].append(values)
+    return week_to_values
+
+def main(input_file=INPUT_FILE, output_file=OUTPUT_FILE, state_file=STATE_FILE, incremental=False, excel=True,
+         cube_file=rollup_cube.PIPELINE_CUBE_FILE):
+    """
+    adds the email adjusted durations and weekly statistics to the tmetric data.
+    input_file and output_file may be compressed (.gz, .bz2 or .xz, see tmetric_io.open_text).
+    The weekly totals are taken from the rollup cube of input_file, stored at cube_file (see rollup_cube.pipeline_cube).
+    With incremental=True the adjustment is cached per week: the input is still read (and fingerprinted) completely,
+    but only the weeks whose rows changed since the last run are recomputed, the processed rows of all other weeks
+    are copied from the previous output. The whole CSV (and Excel) output is then rewritten, unless nothing changed
+    at all, in which case the previous output is left as it is
+    """
+    rows, fingerprints, input_fieldnames = read_rows(input_file)
+    # the weekly totals come from the rollup cube of the input (rebuilt only when the input changed)
+    weekly_email = rollup_cube.pipeline_cube(input_file, cube_file).weekly_email()
+    weeks = week_fingerprints(rows, fingerprints)
+    order = week_order(rows)
+    week_to_rows = group_by_week(rows)
+
+    state = load_state(state_file) if incremental else None
+    previous = None
+    dirty = set()
+    # the previous output is only reused if it is exactly the file written together with the state
+    if (state is not None and state['input_fieldnames'] == input_fieldnames and os.path.exists(output_file)
+            and state.get('output') == output_identity(output_file)):
+        previous = read_previous_output(output_file, state['fieldnames'])
+    if previous is not None:
+        dirty = {week for week, h in weeks.items() if state['weeks'].get(week) != h}
+        # clean weeks must have as many rows in the previous output as in the input
+        if any(len(previous.get(week.isoformat(), [])) != len(week_rows)
+               for week, week_rows in week_to_rows.items() if week.isoformat() not in dirty):
+            previous = None
+
+    if previous is None:
+        # full run
+        for week, week_rows in week_to_rows.items():
+            adjust_week(week, week_rows, weekly_email[week])
+        fieldnames = output_fieldnames(rows)
+        output_rows = rows
+    else:
+        fieldnames = state['fieldnames']
+        removed = set(state['weeks']) - set(weeks)
+        if (not dirty and not removed and state.get('order') == order
+                and (not excel or os.path.exists(excel_filename(output_file)))):
+            print(f"incremental run: none of {len(weeks)} weeks changed, {output_file} is up to date")
+            return
+        for week, week_rows in week_to_rows.items():
+            if week.isoformat() in dirty:
+                adjust_week(week, week_rows, weekly_email[week])
+        print(f"incremental run: {len(dirty)} of {len(weeks)} weeks recomputed, {len(removed)} removed")
+        # keep the order of the input, clean weeks have exactly the same rows as before
+        previous_rows = {week: iter(values) for week, values in previous.items()}
+        output_rows = []
+        for row in rows:
+            week = week_start(row['parsed_day']).isoformat()
+            output_rows.append(row if week in dirty else next(previous_rows[week]))
+
+    # Write output
+    write_csv(output_file, fieldnames, output_rows)
+    if excel:
+        write_excel(output_file, fieldnames, output_rows)
+    save_state(state_file, input_fieldnames, fieldnames, weeks, order, output_file)
+
 if __name__ == '__main__':
-    main()
+    # --compress=gz (or bz2, xz) writes OUTPUT_FILE compressed
+    compress = [arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--compress=')]
+    main(output_file=OUTPUT_FILE + ('.' + compress[-1] if compress else ''),
+         incremental='--incremental' in sys.argv, excel='--no-excel' not in sys.argv)
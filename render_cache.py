@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+
+
+# maps output image -> key of the data and parameters it was rendered from
+CACHE_FILE = 'plots/.render_cache.json'
+
+
+def render_key(day_hours: dict, **params) -> str:
+    """
+    returns a hash of the day totals of a plot plus the parameters used to render it
+    :param day_hours: dict with keys: dates, values: hours or another per-day value (empty values are ignored)
+    :param params: render parameters, e.g. colormap name, palette, thresholds and the version of the drawing code
+    (must be json serializable)
+    :return: hex digest
+    """
+    h = hashlib.sha256()
+    for day in sorted(day_hours):
+        hours = day_hours[day]
+        if hours:
+            h.update('{}={!r};'.format(day.isoformat(), hours).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def _load(cache_file: str) -> dict:
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_fresh(output: str, key: str, cache_file: str = CACHE_FILE) -> bool:
+    """
+    checks whether output exists and was rendered with the given key
+    """
+    return os.path.exists(output) and _load(cache_file).get(output) == key
+
+
+def record(output: str, key: str, cache_file: str = CACHE_FILE) -> None:
+    """
+    remembers that output has been rendered with the given key
+    """
+    cache = _load(cache_file)
+    cache[output] = key
+    os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, cache_file)
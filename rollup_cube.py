@@ -0,0 +1,262 @@
+import csv
+import datetime
+import os
+import sys
+
+import numpy as np
+
+from tmetric_io import PIPELINE_DAYFIRST, PIPELINE_YEARFIRST, day_hours, open_text, parse_day, parse_duration, \
+    row_tags
+from validation import validate_rows
+
+
+EMAIL_PROJECT = 'Email (various)'  # see process_tmetric_email_adjusted.PROJECT_NAME
+INPUT_FILE = 'data/tmetric.csv'
+CUBE_FILE = 'data/tmetric_cube.npz'
+# cube with Day parsed as the email adjusted pipeline does, for the reports compared with tmetric_processed.csv
+PIPELINE_CUBE_FILE = 'data/tmetric_cube_pipeline.npz'
+
+
+def data_version(filename: str, dayfirst: bool = True, yearfirst: bool = False, dedup: bool = True) -> str:
+    """
+    identifies the version of a data file by its size and modification time, and how it is read (see RollupCube.build)
+    """
+    st = os.stat(filename)
+    return '{}:{}:{}:dayfirst={}:yearfirst={}:dedup={}'.format(os.path.abspath(filename), st.st_size, st.st_mtime_ns,
+                                                                dayfirst, yearfirst, dedup)
+
+
+def _sparse_sum(first_ordinal, days, dims, seconds):
+    '''
+    sums seconds over equal (day, *dims) keys
+    :return: tuple (day ordinals, dims..., seconds) with one entry per non-empty cell
+    '''
+    shape = (int(days.max()) - first_ordinal + 1,) + tuple(int(d.max()) + 1 if len(d) else 1 for d in dims)
+    flat = np.ravel_multi_index((days - first_ordinal,) + tuple(dims), shape)
+    cells, inverse = np.unique(flat, return_inverse=True)
+    sums = np.bincount(inverse, weights=seconds).astype(np.int64)
+    index = np.unravel_index(cells, shape)
+    return (index[0] + first_ordinal,) + tuple(i.astype(np.int32) for i in index[1:]) + (sums,)
+
+
+class RollupCube(object):
+    '''
+    durations (seconds) per day x project x user, and per day x tag x user, stored as sparse cells.
+    Built once per data version, after that all reports are computed from the cells only:
+    hours_per_day/hours_per_week (Work), hours_per_tag (Work.plot_tags_pie), weekly_email and adjusted day hours
+    (process_tmetric_email_adjusted, histogram_hours_per_workday.py and the calendar scripts)
+    '''
+    def __init__(self, version, projects, users, tags, cells, tag_cells) -> None:
+        """
+        :param cells: tuple of arrays (day ordinal, project index, user index, seconds)
+        :param tag_cells: tuple of arrays (day ordinal, tag index, user index, seconds)
+        """
+        self.version = version
+        self.projects = list(projects)
+        self.users = list(users)
+        self.tags = list(tags)
+        self.day, self.project, self.user, self.seconds = cells
+        self.tag_day, self.tag, self.tag_user, self.tag_seconds = tag_cells
+
+    @classmethod
+    def build(cls, filename: str, dayfirst: bool = True, yearfirst: bool = False, dedup: bool = True) -> 'RollupCube':
+        """
+        reads a tmetric CSV file once and sums its durations into cells. The defaults give the totals of Work,
+        see pipeline_cube for those of process_tmetric_email_adjusted
+        :param dayfirst: how Day is parsed (see tmetric_io.parse_day), the defaults are those of Activity
+        :param yearfirst: see dayfirst
+        :param dedup: remove the rows Work removes, i.e. duplicates and unparsable rows (validation 'fix' policy)
+        """
+        projects, users, tags = {}, {}, {}
+        days, project_index, user_index, seconds = [], [], [], []
+        tag_rows, tag_index = [], []
+        with open_text(filename, encoding='utf-8-sig') as csvfile:
+            rows = csv.DictReader(csvfile)
+            if dedup:
+                rows, _ = validate_rows(list(rows), 'fix')
+            for row in rows:
+                days.append(parse_day(row['Day'], dayfirst, yearfirst).toordinal())
+                project_index.append(projects.setdefault(row.get('Project', ''), len(projects)))
+                user_index.append(users.setdefault(row.get('User', ''), len(users)))
+                seconds.append(parse_duration(row['Duration']))
+                for tag in row_tags(row):
+                    tag_rows.append(len(days) - 1)
+                    tag_index.append(tags.setdefault(tag, len(tags)))
+        if not days:
+            empty = (np.zeros(0, dtype=np.int64),) * 4
+            return cls(data_version(filename, dayfirst, yearfirst, dedup), projects, users, tags, empty, empty)
+
+        days = np.array(days, dtype=np.int64)
+        user_index = np.array(user_index, dtype=np.int64)
+        seconds = np.array(seconds, dtype=np.int64)
+        tag_rows = np.array(tag_rows, dtype=np.int64)
+        first = int(days.min())
+        cells = _sparse_sum(first, days, (np.array(project_index, dtype=np.int64), user_index), seconds)
+        if len(tag_rows):
+            tag_cells = _sparse_sum(first, days[tag_rows], (np.array(tag_index, dtype=np.int64), user_index[tag_rows]),
+                                    seconds[tag_rows])
+        else:
+            tag_cells = (np.zeros(0, dtype=np.int64),) * 4
+        return cls(data_version(filename, dayfirst, yearfirst, dedup), projects, users, tags, cells, tag_cells)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez_compressed(path, version=np.array(self.version), projects=np.array(self.projects, dtype=str),
+                            users=np.array(self.users, dtype=str), tags=np.array(self.tags, dtype=str),
+                            day=self.day, project=self.project, user=self.user, seconds=self.seconds,
+                            tag_day=self.tag_day, tag=self.tag, tag_user=self.tag_user, tag_seconds=self.tag_seconds)
+
+    @classmethod
+    def load(cls, path: str) -> 'RollupCube':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(str(data['version']), data['projects'].tolist(), data['users'].tolist(), data['tags'].tolist(),
+                       (data['day'], data['project'], data['user'], data['seconds']),
+                       (data['tag_day'], data['tag'], data['tag_user'], data['tag_seconds']))
+
+    @classmethod
+    def load_or_build(cls, filename: str = INPUT_FILE, path: str = CUBE_FILE, dayfirst: bool = True,
+                      yearfirst: bool = False, dedup: bool = True) -> 'RollupCube':
+        """
+        loads the cube stored at path, or (re)builds and stores it if the data file (or how it is read, see build)
+        changed since
+        """
+        if os.path.exists(path):
+            cube = cls.load(path)
+            if cube.version == data_version(filename, dayfirst, yearfirst, dedup):
+                return cube
+        cube = cls.build(filename, dayfirst, yearfirst, dedup)
+        cube.save(path)
+        return cube
+
+    def _mask(self, days, users, projects=None, user=None, project=None, start_date=None, end_date=None):
+        mask = np.ones(len(days), dtype=bool)
+        if user is not None:
+            mask &= users == (self.users.index(user) if user in self.users else -1)
+        if project is not None:
+            mask &= projects == (self.projects.index(project) if project in self.projects else -1)
+        if start_date is not None:
+            mask &= days >= start_date.toordinal()
+        if end_date is not None:
+            mask &= days <= end_date.toordinal()
+        return mask
+
+    def _sum_by(self, keys, seconds):
+        keys, inverse = np.unique(keys, return_inverse=True)
+        return keys, np.bincount(inverse, weights=seconds)
+
+    def hours_per_day(self, **filters):
+        """
+        :param filters: user, project, start_date, end_date (all optional)
+        :return: dict with keys: dates, values: timedelta (as Work.hours_per_day)
+        """
+        mask = self._mask(self.day, self.user, self.project, **filters)
+        days, sums = self._sum_by(self.day[mask], self.seconds[mask])
+        return {datetime.date.fromordinal(int(d)): datetime.timedelta(seconds=int(s)) for d, s in zip(days, sums)}
+
+    def hours_per_week(self, **filters):
+        """
+        :return: dict with keys: Mondays, values: timedelta (as Work.hours_per_week)
+        """
+        mask = self._mask(self.day, self.user, self.project, **filters)
+        days = self.day[mask]
+        weeks, sums = self._sum_by(days - (days - 1) % 7, self.seconds[mask])
+        return {datetime.date.fromordinal(int(w)): datetime.timedelta(seconds=int(s)) for w, s in zip(weeks, sums)}
+
+    def hours_per_tag(self, year: int, user: str = None):
+        """
+        :return: dict with keys: tags, values: timedelta (as Work.hours_per_tag)
+        """
+        mask = self._mask(self.tag_day, self.tag_user, user=user, start_date=datetime.date(year, 1, 1),
+                          end_date=datetime.date(year, 12, 31))
+        tags, sums = self._sum_by(self.tag[mask], self.tag_seconds[mask])
+        return {self.tags[int(t)]: datetime.timedelta(seconds=int(s)) for t, s in zip(tags, sums)}
+
+    def weekly_email(self):
+        """
+        :return: dict Monday -> (email seconds, total seconds), the weekly totals of process_tmetric_email_adjusted
+        """
+        weeks = self.day - (self.day - 1) % 7
+        week_keys, inverse = np.unique(weeks, return_inverse=True)
+        total = np.bincount(inverse, weights=self.seconds, minlength=len(week_keys))
+        email = np.bincount(inverse, weights=self.seconds * self._is_email(), minlength=len(week_keys))
+        return {datetime.date.fromordinal(int(w)): (int(e), int(t)) for w, e, t in zip(week_keys, email, total)}
+
+    def _is_email(self):
+        email = self.projects.index(EMAIL_PROJECT) if EMAIL_PROJECT in self.projects else -1
+        return self.project == email
+
+    def adjusted_seconds(self):
+        """
+        email time of every week redistributed proportionally over the non-email cells of that week (all users
+        together), as process_tmetric_email_adjusted does per row
+        :return: np.ndarray of adjusted seconds per cell
+        """
+        is_email = self._is_email()
+        weeks = self.day - (self.day - 1) % 7
+        _, inverse = np.unique(weeks, return_inverse=True)
+        email = np.bincount(inverse, weights=self.seconds * is_email)
+        non_email = np.bincount(inverse, weights=self.seconds * ~is_email)
+        factor = np.divide(email, non_email, out=np.zeros_like(email), where=non_email > 0)[inverse]
+        adjusted = self.seconds * (1 + factor)
+        # weeks with only email are not adjusted
+        adjusted[is_email & (non_email[inverse] > 0)] = 0
+        return adjusted
+
+    def day_hours(self, year: int = None, adjusted: bool = True, user: str = None):
+        """
+        :param year: only days of this year (all days if None)
+        :param adjusted: use the email adjusted durations
+        :return: dict with keys: dates, values: hours (as holiday_calendar.get_day_hours)
+        """
+        seconds = self.adjusted_seconds() if adjusted else self.seconds
+        start_date = datetime.date(year, 1, 1) if year is not None else None
+        end_date = datetime.date(year, 12, 31) if year is not None else None
+        mask = self._mask(self.day, self.user, user=user, start_date=start_date, end_date=end_date)
+        days, sums = self._sum_by(self.day[mask], seconds[mask])
+        return {datetime.date.fromordinal(int(d)): s / 3600 for d, s in zip(days, sums)}
+
+    def years(self):
+        return sorted({datetime.date.fromordinal(int(d)).year for d in np.unique(self.day)})
+
+
+def pipeline_cube(filename: str = INPUT_FILE, path: str = PIPELINE_CUBE_FILE) -> RollupCube:
+    """
+    the cube of the email adjusted pipeline (process_tmetric_email_adjusted): Day parsed as it does and all rows
+    kept, so weekly_email and the adjusted day hours are those of tmetric_processed.csv
+    """
+    return RollupCube.load_or_build(filename, path, PIPELINE_DAYFIRST, PIPELINE_YEARFIRST, dedup=False)
+
+
+def calendar_day_hours(processed_file: str, timezones=None, filename: str = INPUT_FILE) -> dict:
+    """
+    the email adjusted hours per day shown by the calendar scripts, from the pipeline cube of filename. The cells only
+    have local days, so with a timezones.TimezoneConfig they are read per entry from processed_file instead (see
+    tmetric_io.day_hours)
+    :return: dict with keys: dates, values: hours
+    """
+    if timezones is not None:
+        return day_hours(processed_file, timezones=timezones)
+    return pipeline_cube(filename).day_hours()
+
+
+def main():
+    import holiday_calendar
+    import holiday_calendar_colormap
+
+    filename = sys.argv[1] if len(sys.argv) > 1 else INPUT_FILE
+    # the calendars show the adjusted hours of tmetric_processed.csv
+    cube = pipeline_cube(filename)
+    print('{} cells, {} tag cells ({})'.format(len(cube.seconds), len(cube.tag_seconds), cube.version))
+    day_hours = cube.day_hours()
+    for year in cube.years():
+        workday_holidays, weekend_worked = holiday_calendar.ThresholdSweep(day_hours, year).days(
+            holiday_calendar.DAILY_THRESHOLD)
+        print('Year {}: workday holidays = {}, worked weekends = {}, tags: {}'.format(
+            year, len(workday_holidays), len(weekend_worked),
+            ', '.join('{} {:.0f}h'.format(tag, td.total_seconds() / 3600)
+                      for tag, td in sorted(cube.hours_per_tag(year).items()))))
+        holiday_calendar_colormap.plot_colormap_calendar(year, cube.day_hours(year))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import calendar
+import datetime
+import html
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+from calendar_colors import COLORMAP_ANCHORS, MAX_HOURS, WEEK_MAX, base_colormap
+from periods import week_matrix
+import tmetric_io
+from timezones import TimezoneConfig
+
+
+LUT_SIZE = 256
+CELL = 50  # distance between day cells in pixels
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+_luts = {}
+
+
+def _rgb(hex_color):
+    return tuple(int(hex_color[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def colormap_lut(cmap_name):
+    """
+    returns a list of LUT_SIZE hex colors for a colormap name from calendar_colors.COLORMAP_ANCHORS, with '_r' for
+    the reversed map
+    """
+    if cmap_name not in _luts:
+        base_name = base_colormap(cmap_name)
+        anchors = [(x, _rgb(c)) for x, c in COLORMAP_ANCHORS[base_name]]
+        lut = []
+        for i in range(LUT_SIZE):
+            x = i / (LUT_SIZE - 1)
+            for (x0, c0), (x1, c1) in zip(anchors, anchors[1:]):
+                if x <= x1:
+                    t = (x - x0) / (x1 - x0) if x1 > x0 else 0.0
+                    lut.append('#%02x%02x%02x' % tuple(round(a + t * (b - a)) for a, b in zip(c0, c1)))
+                    break
+        if cmap_name.endswith('_r'):
+            lut.reverse()
+        _luts[cmap_name] = lut
+    return _luts[cmap_name]
+
+
+def _color(lut, value, maximum):
+    # same normalization as holiday_calendar_colormap: value / maximum, clipped to 1, white for 0,
+    # and the same lookup as matplotlib's Colormap: int(x * N), clipped to the last entry
+    if value <= 0:
+        return '#ffffff'
+    return lut[min(int(min(value / maximum, 1.0) * LUT_SIZE), LUT_SIZE - 1)]
+
+
+def colormap_calendar_svg(year, day_hours, cmap_name='viridis_r'):
+    """
+    renders the work hours calendar of plot_colormap_calendar as SVG
+    :param year: int
+    :param day_hours: dict with keys: dates, values: hours
+    :param cmap_name: colormap, see COLORMAP_ANCHORS
+    :return: SVG document as string
+    """
+    lut = colormap_lut(cmap_name)
+    jan1 = datetime.date(year, 1, 1)
+    first_monday = jan1 - datetime.timedelta(days=jan1.weekday())
+    hours_matrix, _, week_totals = week_matrix(day_hours, jan1, datetime.date(year, 12, 31))
+
+    top = 90
+    width = 9 * CELL + 80
+    height = top + len(hours_matrix) * CELL + 20
+    out = ['<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" font-family="sans-serif" '
+           'font-weight="bold" text-anchor="middle">'.format(width, height),
+           '<rect width="100%" height="100%" fill="white"/>',
+           '<text x="{}" y="30" font-size="22">Work Hours Calendar {} — {}</text>'.format(
+               width // 2, year, html.escape(cmap_name))]
+    for day_idx, wd in enumerate(WEEKDAYS):
+        out.append('<text x="{}" y="{}" font-size="15" fill="midnightblue">{}</text>'.format(
+            day_idx * CELL + CELL // 2, top - 12, wd))
+    out.append('<text x="{}" y="{}" font-size="15" fill="midnightblue">Total #h/week</text>'.format(
+        7 * CELL + CELL, top - 12))
+
+    for week_idx, week_hours in enumerate(hours_matrix):
+        y = top + week_idx * CELL
+        for day_idx, hours in enumerate(week_hours):
+            date_obj = first_monday + datetime.timedelta(days=7 * week_idx + day_idx)
+            x = day_idx * CELL
+            out.append('<rect x="{}" y="{}" width="{}" height="{}" fill="{}" fill-opacity="0.7" stroke="gray" '
+                       'stroke-width="0.7"/>'.format(x + 2, y + 2, CELL - 4, CELL - 4,
+                                                      _color(lut, hours, MAX_HOURS)))
+            out.append('<text x="{}" y="{}" font-size="15">{}</text>'.format(x + CELL // 2, y + 22, date_obj.day))
+            if hours > 0:
+                out.append('<text x="{}" y="{}" font-size="11" fill="navy">{:.1f}</text>'.format(
+                    x + CELL // 2, y + 40, hours))
+            if date_obj.day == 1:
+                out.append('<text x="{}" y="{}" font-size="11" fill="darkred">{}</text>'.format(
+                    x + CELL // 2, y + 8, calendar.month_name[date_obj.month]))
+        week_total = week_totals[week_idx]
+        out.append('<rect x="{}" y="{}" width="{}" height="{}" fill="{}" fill-opacity="0.85" stroke="gray" '
+                   'stroke-width="0.7"/>'.format(7 * CELL + 10, y + 4, 2 * CELL - 20, CELL - 8,
+                                                  _color(lut, week_total, WEEK_MAX)))
+        out.append('<text x="{}" y="{}" font-size="13">{:.1f}</text>'.format(7 * CELL + CELL, y + 30, week_total))
+
+    # colorbar for the day scale
+    bar_x = 9 * CELL + 20
+    bar_height = height - top - 40
+    for i in range(0, LUT_SIZE, 4):
+        out.append('<rect x="{}" y="{:.1f}" width="16" height="{:.1f}" fill="{}"/>'.format(
+            bar_x, top + bar_height * (1 - (i + 4) / LUT_SIZE), bar_height * 4 / LUT_SIZE + 0.5, lut[i]))
+    for h in range(0, int(MAX_HOURS) + 1, 2):
+        out.append('<text x="{}" y="{:.1f}" font-size="10" font-weight="normal" text-anchor="start">{}h</text>'.format(
+            bar_x + 20, top + bar_height * (1 - h / MAX_HOURS) + 4, h))
+    out.append('</svg>')
+    return '\n'.join(out)
+
+
+def holiday_calendar_svg(year, workday_holidays, weekend_worked):
+    """
+    renders the calendar of holiday_calendar.plot_holiday_calendar as SVG: workday holidays green, worked weekend
+    days red
+    :return: SVG document as string
+    """
+    month_width = 7 * 30 + 20
+    month_height = 7 * 30 + 40
+    out = ['<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" font-family="sans-serif" '
+           'text-anchor="middle">'.format(4 * month_width, 3 * month_height + 50),
+           '<rect width="100%" height="100%" fill="white"/>',
+           '<text x="{}" y="32" font-size="24">Holiday Calendar {}</text>'.format(2 * month_width, year)]
+    for month in range(1, 13):
+        x0 = ((month - 1) % 4) * month_width + 10
+        y0 = ((month - 1) // 4) * month_height + 50
+        out.append('<rect x="{}" y="{}" width="{}" height="{}" rx="8" fill="none" stroke="black" stroke-width="2"/>'
+                   .format(x0, y0, 7 * 30, month_height - 10))
+        out.append('<text x="{}" y="{}" font-size="15" font-weight="bold">{}</text>'.format(
+            x0 + 105, y0 + 20, calendar.month_name[month]))
+        for day_idx, wd in enumerate(WEEKDAYS):
+            out.append('<text x="{}" y="{}" font-size="9">{}</text>'.format(x0 + day_idx * 30 + 15, y0 + 38, wd))
+        for week_idx, week in enumerate(calendar.monthcalendar(year, month)):
+            for day_idx, day in enumerate(week):
+                if day == 0:
+                    continue
+                date_obj = datetime.date(year, month, day)
+                if date_obj in workday_holidays:
+                    color = 'lightgreen'
+                elif date_obj in weekend_worked:
+                    color = 'red'
+                else:
+                    color = 'white'
+                x = x0 + day_idx * 30
+                y = y0 + 44 + week_idx * 26
+                out.append('<rect x="{}" y="{}" width="26" height="22" rx="5" fill="{}" fill-opacity="0.7" '
+                           'stroke="gray"/><text x="{}" y="{}" font-size="11">{}</text>'.format(
+                               x + 2, y, color, x + 15, y + 15, day))
+    out.append('</svg>')
+    return '\n'.join(out)
+
+
+def html_page(title, svgs):
+    """
+    wraps SVG documents in a self-contained HTML page
+    """
+    body = '\n'.join('<div>{}</div>'.format(svg) for svg in svgs)
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{}</title></head>\n'
+            '<body>\n{}\n</body></html>\n'.format(html.escape(title), body))
+
+
+def read_user_day_hours(input_file, timezones=None):
+    """
+    reads the processed tmetric data once
+    :param timezones: timezones.TimezoneConfig, if given the hours are counted on the days of its reporting zone
+    :return: dict (user, year) -> dict date -> adjusted hours
+    """
+    result = defaultdict(lambda: defaultdict(float))
+    for (user, date_obj), hours in tmetric_io.day_hours(input_file, timezones=timezones, by_user=True).items():
+        result[(user, date_obj.year)][date_obj] += hours
+    return result
+
+
+def report_filename(user, year):
+    # user names may contain path separators and other characters that are not allowed in file names
+    name = re.sub(r'[^\w-]+', '_', user).strip('_') if user else ''
+    return os.path.join('reports', '{}_{}.html'.format(name or 'all', year))
+
+
+def main():
+    input_file = sys.argv[1] if len(sys.argv) > 1 else 'data/tmetric_processed.csv'
+    os.makedirs('reports', exist_ok=True)
+    user_day_hours = read_user_day_hours(input_file, TimezoneConfig.configured())
+    start = time.perf_counter()
+    for (user, year), day_hours in sorted(user_day_hours.items()):
+        svg = colormap_calendar_svg(year, day_hours)
+        with open(report_filename(user, year), 'w', encoding='utf-8') as f:
+            f.write(html_page('{} {}'.format(user, year), [svg]))
+    elapsed = time.perf_counter() - start
+    print('{} calendars in {:.2f}s ({:.0f} per minute)'.format(
+        len(user_day_hours), elapsed, 60 * len(user_day_hours) / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
-import csv
-from dateutil.parser import parse
+import sys
+import tracemalloc
 from collections import defaultdict
-from typing import Dict, List
+from types import MappingProxyType
+from typing import Dict, List, Tuple
 import matplotlib.pyplot as plt
 from matplotlib import colors as mcolors
 import numpy as np
@@ -11,28 +12,17 @@ from pprint import pprint
 
 import datetime
 
+from periods import weekday, week_start, CalendarTable, dense_hours, week_range, week_matrix
+from tmetric_io import csv_header, mmap_columns, row_tags, day_totals, parse_day, parse_clock, parse_duration
+from timezones import TimezoneConfig, normalize
+from validation import validate_rows
 
-def weekday(day: datetime.date) -> int:
-    """
-    returns the numerical weekday of day
-    """
-    return int(day.strftime("%u"))
 
-def weeknr(day: datetime.date) -> int:
-    """
-    returns number of the week
-    :param day:
-    :return:
-    """
-    return int(day.strftime("%V"))
+# the columns read by Work
+ACTIVITY_COLUMNS = ('Day', 'User', 'Project', 'Project Code', 'Client', 'Time Entry', 'Work Type', 'Start Time',
+                    'End Time', 'Duration')
+_NO_ROW = MappingProxyType({})  # Activity.row if no extra columns are kept
 
-def week_start(day: datetime.date) -> datetime.date:
-    """
-    returns the date Monday of the same week as day
-    :param day: datetime.date
-    :return:
-    """
-    return day - datetime.timedelta(days=weekday(day) - 1)  # the date of Monday of that week
 
 def hours_minutes(td: datetime.timedelta) -> str:
     """
@@ -54,64 +44,331 @@ def hours_minutes(td: datetime.timedelta) -> str:
 class Activity(object):
     '''
     and activity has Day,Academic Year,Year,Week,Weekday,User,Project,Project Code,Client,Time Entry,Tags,Start Time,End Time,Duration,Issue Id,Link
+    (Academic Year, Year, Week and Weekday are not read, they follow from the day, see periods.CalendarTable)
+
+    Only the columns needed by Work are kept: the day, the start time and duration as seconds (start_time, end_time
+    and duration are computed from those on access) and the strings, interned so equal values are shared. Other
+    columns are only kept in self.row if asked for with extra_columns
     '''
-    def __init__(self, row: dict) -> None:
+    __slots__ = ('day', 'start_seconds', 'duration_seconds', 'user', 'project', 'project_code', 'client', 'tags',
+                 'row')
+
+    def __init__(self, row: dict, extra_columns: Tuple[str, ...] = (),
+                 parsed: Tuple[datetime.date, int, int] = None) -> None:
         """
         reads in a row of tmetric CSV file and saves it
         check https://docs.python.org/3/library/datetime.html#strftime-strptime-behavior
         :param row: CSV row of tmetric data
+        :param extra_columns: names of further columns to keep in self.row
+        :param parsed: day, start seconds and duration seconds of the row if parsed already (see
+        validation.ValidationReport.parsed)
         """
-        dt = parse(row['Day'], dayfirst=True)
-        self.day = dt.date()
-
-        # self.week_nr = int(row['Week'])
-        # assert int(row['Week']) == int(dt.strftime("%V"))
-        # self.weekday = int(row['Weekday'])  # Monday: 1, Tue: 2, ..., Sun: 7
-        # assert int(row['Weekday']) == weekday(self.day)
-        # self.week_start = week_start(self.day)   # the date of Monday of that week
-        dt = parse(row['Start Time'])
-        dt = dt.replace(year=self.day.year)
-        dt = dt.replace(month=self.day.month)
-        dt = dt.replace(day=self.day.day)
-        self.start_time = dt
-        dt = parse(row['End Time'])
-        dt = dt.replace(year=self.day.year)
-        dt = dt.replace(month=self.day.month)
-        dt = dt.replace(day=self.day.day)
-        self.end_time = dt
-        td = parse(row['Duration'])
-        self.duration = datetime.timedelta(hours=td.hour, minutes=td.minute)
-        if not(self.end_time - self.start_time == self.duration):
-            print(self.end_time, self.start_time, self.duration)
-            self.end_time = self.start_time + self.duration
-        assert self.end_time - self.start_time == self.duration, 'calculation trouble'
-
-        # Add this to store tags and optionally the row
-        self.tags = row.get('Work Type', '')
-        self.row = row  # optional, for future flexibility
+        if parsed is not None:
+            self.day, self.start_seconds, self.duration_seconds = parsed
+        else:
+            # the parsers are cached, so equal days and times share one object
+            self.day = parse_day(row['Day'])
+            self.start_seconds = parse_clock(row['Start Time'])
+            self.duration_seconds = parse_duration(row['Duration'])
+        # the end time follows from start time and duration: mismatches with End Time are reported in bulk by
+        # validation.validate_rows, the duration is leading
+
+        self.user = sys.intern(row.get('User') or '')
+        self.project = sys.intern(row.get('Project') or '')
+        self.project_code = sys.intern(row.get('Project Code') or '')
+        self.client = sys.intern(row.get('Client') or '')
+        self.tags = sys.intern(row.get('Work Type') or '')
+        self.row = {column: row.get(column, '') for column in extra_columns} if extra_columns else _NO_ROW
+
+    @property
+    def start_time(self) -> datetime.datetime:
+        return datetime.datetime.combine(self.day, datetime.time()) + datetime.timedelta(seconds=self.start_seconds)
+
+    @property
+    def end_time(self) -> datetime.datetime:
+        return self.start_time + self.duration
+
+    @property
+    def duration(self) -> datetime.timedelta:
+        return datetime.timedelta(seconds=self.duration_seconds)
+
+    def tag_list(self) -> List[str]:
+        """
+        returns the tags, or the project code if there are none (see tmetric_io.row_tags)
+        """
+        return row_tags({'Work Type': self.tags, 'Project Code': self.project_code})
+
+
+def activity_memory(rows: List[dict], **kwargs) -> float:
+    """
+    measures the memory allocated per Activity with tracemalloc
+    :param rows: CSV rows of tmetric data
+    :param kwargs: passed on to Activity
+    :return: bytes per activity
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        activities = [Activity(row, **kwargs) for row in rows]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / max(len(activities), 1)
 
 
 class Work(object):
     '''
     maintains a list of activities and allows to access functions of those
     '''
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, policy: str = 'fix', extra_columns: Tuple[str, ...] = (),
+                 timezones: TimezoneConfig = None) -> None:
         '''
         reads in activities and stores them in a list
         :param filename: name of csv file with tmetric data
+        :param policy: what to do with invalid rows: 'fix', 'drop' or 'fail', see validation.validate_rows.
+        The report is kept as self.validation
+        :param extra_columns: further columns to keep in Activity.row, e.g. ('Time Entry', 'Issue Id')
+        :param timezones: zones of the users/file and the reporting zone. If given, the aggregates (hours_per_day,
+        hours_per_week, hours_per_tag, group_by and the plots) are computed in the reporting zone, with entries
+        crossing midnight split over both days. The Activity objects keep the local times
+        '''
+        self.store = None  # set by from_sqlite
+        self.cube = None  # set by from_cube
+        self.filters = {}
+        self.filename = filename
+        self.extra_columns = tuple(extra_columns)
+        self.timezones = timezones
+        self._columns = None
+        self._calendar = None
+        # only the columns used by validate_rows and Activity are read, see tmetric_io.mmap_columns
+        header = csv_header(filename)
+        columns = [column for column in ACTIVITY_COLUMNS + self.extra_columns if column in header]
+        rows = [dict(zip(columns, values)) for values in mmap_columns(filename, columns)]
+        rows, self.validation = validate_rows(rows, policy)
+        # the values parsed by the validation, with one date object per day as parse_day gives
+        parsed = self.validation.parsed
+        dates = {day: datetime.date.fromordinal(day) for day in np.unique(parsed['day']).tolist()}
+        self._activities = [Activity(row, self.extra_columns, (dates[day], start, duration))
+                            for row, day, start, duration in zip(rows, parsed['day'].tolist(),
+                                                                 parsed['start'].tolist(), parsed['duration'].tolist())]
+
+    @classmethod
+    def from_sqlite(cls, db_path: str, user: str = None, project: str = None,
+                    start_date: datetime.date = None, end_date: datetime.date = None) -> 'Work':
+        '''
+        opens the activities stored in a sqlite database (see activity_store.py), optionally restricted to one user,
+        one project and/or a date range. hours_per_day, hours_per_week, holidays and hours_per_tag are computed
+        by SQL queries, the Activity objects are only constructed when self.activities is accessed
+        :param db_path: filename of the sqlite database
+        :return: Work
         '''
-        self.activities = []
-        with open(filename, newline='', encoding='utf-8-sig') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                act = Activity(row)
-                self.activities.append(act)
+        from activity_store import ActivityStore
+
+        work = cls.__new__(cls)
+        work.store = ActivityStore(db_path)
+        work.cube = None
+        work.filters = {'user': user, 'project': project, 'start_date': start_date, 'end_date': end_date}
+        work.filename = db_path
+        work.extra_columns = ()
+        work.timezones = None
+        work.validation = None
+        work._activities = None
+        work._columns = None
+        work._calendar = None
+        return work
+
+    @classmethod
+    def from_cube(cls, filename: str, user: str = None, project: str = None,
+                  start_date: datetime.date = None, end_date: datetime.date = None) -> 'Work':
+        '''
+        uses the rollup cube of a tmetric CSV file (see rollup_cube.py, only rebuilt when the file changed), optionally
+        restricted to one user, one project and/or a date range. hours_per_day, hours_per_week, holidays, weekends
+        and hours_per_tag are computed from its cells, the file is only read again when self.activities is accessed
+        :param filename: name of csv file with tmetric data
+        :return: Work
+        '''
+        from rollup_cube import RollupCube
+
+        work = cls.__new__(cls)
+        work.store = None
+        work.cube = RollupCube.load_or_build(filename)
+        work.filters = {'user': user, 'project': project, 'start_date': start_date, 'end_date': end_date}
+        work.filename = filename
+        work.extra_columns = ()
+        work.timezones = None
+        work.validation = None
+        work._activities = None
+        work._columns = None
+        work._calendar = None
+        return work
+
+    @property
+    def activities(self) -> List[Activity]:
+        if self._activities is None:
+            if self.cube is not None:
+                work = Work(self.filename)
+                self.validation = work.validation
+                filters = self.filters
+                self._activities = [
+                    act for act in work.activities
+                    if (filters['user'] is None or act.user == filters['user'])
+                    and (filters['project'] is None or act.project == filters['project'])
+                    and (filters['start_date'] is None or act.day >= filters['start_date'])
+                    and (filters['end_date'] is None or act.day <= filters['end_date'])]
+            else:
+                self._activities = [Activity(row, self.extra_columns) for row in self.store.rows(**self.filters)]
+        return self._activities
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        '''
+        returns the activities as numpy columns (computed once): 'day' (day ordinals), 'duration' (seconds),
+        'user' and 'project' (strings), and the exploded tags as 'tag' with 'tag_index' pointing into the other
+        columns. With timezones, there is one element per part of an activity in the reporting zone
+        :return: dict of np.ndarray
+        '''
+        if self._columns is None:
+            activities = self.activities
+            tag_index = []
+            tags = []
+            for i, act in enumerate(activities):
+                for tag in act.tag_list():
+                    tag_index.append(i)
+                    tags.append(tag)
+            self._columns = {
+                'day': np.fromiter((act.day.toordinal() for act in activities), dtype=np.int64,
+                                   count=len(activities)),
+                'duration': np.fromiter((act.duration_seconds for act in activities), dtype=np.int64,
+                                        count=len(activities)),
+                'user': np.array([act.user for act in activities], dtype=object),
+                'project': np.array([act.project for act in activities], dtype=object),
+                'tag_index': np.array(tag_index, dtype=np.int64),
+                'tag': np.array(tags, dtype=object),
+            }
+            if self.timezones is not None:
+                self._columns = self._normalized_columns(self._columns)
+        return self._columns
+
+    def _normalized_columns(self, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        '''
+        converts the columns to the reporting zone of self.timezones, see timezones.normalize
+        '''
+        activities = self.activities
+        zone_of = {user: self.timezones.zone(user, self.filename) for user in set(columns['user'])}
+        zones = np.array([zone_of[user] for user in columns['user']], dtype=object)
+        start = np.fromiter((act.start_seconds for act in activities), dtype=np.int64, count=len(activities))
+        day, _, duration, index = normalize(columns['day'], start, columns['duration'], zones,
+                                            self.timezones.report)
+        # every tag of an activity goes with each of its parts
+        parts = np.bincount(index, minlength=len(activities))
+        first_part = np.cumsum(parts) - parts
+        tag_activity = columns['tag_index']
+        tag_repeat = np.repeat(np.arange(len(tag_activity)), parts[tag_activity])
+        tag_part = first_part[tag_activity][tag_repeat] + np.arange(len(tag_repeat)) - np.repeat(
+            np.cumsum(parts[tag_activity]) - parts[tag_activity], parts[tag_activity])
+        return {
+            'day': day,
+            'duration': duration,
+            'user': columns['user'][index],
+            'project': columns['project'][index],
+            'tag_index': tag_part,
+            'tag': columns['tag'][tag_repeat],
+        }
+
+    def calendar(self) -> CalendarTable:
+        '''
+        returns the calendar lookup table covering all days of the activities
+        '''
+        if self._calendar is None:
+            days = self.columns()['day']
+            if len(days):
+                self._calendar = CalendarTable(datetime.date.fromordinal(int(days.min())),
+                                               datetime.date.fromordinal(int(days.max())))
+            else:
+                self._calendar = CalendarTable(datetime.date.today(), datetime.date.today())
+        return self._calendar
+
+    def group_by(self, period: str, by: str = None) -> Dict[object, datetime.timedelta]:
+        '''
+        sums the durations per period, optionally split by project, tag or user
+        :param period: one of periods.PERIODS: day, weekday, week, iso_week, month, quarter, year, academic_year
+        :param by: None, 'project', 'tag' or 'user'
+        :return: dict with keys: period (see CalendarTable.decode), or tuple (period, project/tag/user) if by is given,
+        values: timedelta
+        '''
+        columns = self.columns()
+        days = columns['day']
+        seconds = columns['duration']
+        if by == 'tag':
+            days = days[columns['tag_index']]
+            seconds = seconds[columns['tag_index']]
+            labels = columns['tag']
+        elif by in ('project', 'user'):
+            labels = columns[by]
+        elif by is not None:
+            raise ValueError('cannot group by {!r}, use project, tag or user'.format(by))
+        if not len(days):
+            return {}
+
+        calendar = self.calendar()
+        period_codes, period_index = np.unique(calendar.lookup(period, days), return_inverse=True)
+        if by is None:
+            label_values, label_index = [None], np.zeros_like(period_index)
+        else:
+            label_values, label_index = np.unique(labels, return_inverse=True)
+        groups, group_index = np.unique(period_index * len(label_values) + label_index, return_inverse=True)
+        sums = np.bincount(group_index, weights=seconds)
+
+        result = {}
+        for group, total in zip(groups, sums):
+            key = calendar.decode(period, period_codes[group // len(label_values)])
+            if by is not None:
+                key = (key, label_values[group % len(label_values)])
+            result[key] = datetime.timedelta(seconds=int(total))
+        return result
+
+    def day_hours(self, start_date: datetime.date, end_date: datetime.date) -> np.ndarray:
+        '''
+        returns the hours worked on every day from start_date to end_date inclusive
+        :return: np.ndarray of float
+        '''
+        if self.store is not None or self.cube is not None:
+            return dense_hours(self.hours_per_day(), start_date, end_date)
+        columns = self.columns()
+        first = start_date.toordinal()
+        n_days = end_date.toordinal() - first + 1
+        index = columns['day'] - first
+        inside = (index >= 0) & (index < n_days)
+        return np.bincount(index[inside], weights=columns['duration'][inside], minlength=n_days) / 3600
+
+    def week_matrix(self, start_date: datetime.date, end_date: datetime.date):
+        '''
+        hours per day of all weeks from the week of start_date to the week of end_date, see periods.week_matrix
+        :return: tuple (weeks x 7 matrix of hours, ISO week numbers, hours per week)
+        '''
+        return week_matrix(self.day_hours(*week_range(start_date, end_date)), start_date, end_date)
+
+    def _store_filters(self, start_date: datetime.date = None, end_date: datetime.date = None) -> dict:
+        '''
+        combines the filters given to from_sqlite with a date range
+        '''
+        filters = dict(self.filters)
+        if start_date is not None and (filters['start_date'] is None or start_date > filters['start_date']):
+            filters['start_date'] = start_date
+        if end_date is not None and (filters['end_date'] is None or end_date < filters['end_date']):
+            filters['end_date'] = end_date
+        return filters
 
     def hours_per_day(self) -> Dict[datetime.date, datetime.timedelta]:
         '''
         computes work hours per day and returns a dictionary with day: hours
         :return: dict with keys: dates, values: timedelta
         '''
+        if self.store is not None:
+            return defaultdict(datetime.timedelta, self.store.hours_per_day(**self.filters))
+        if self.cube is not None:
+            return defaultdict(datetime.timedelta, self.cube.hours_per_day(**self.filters))
+        if self.timezones is not None:
+            return defaultdict(datetime.timedelta, self.group_by('day'))
         day_sum = defaultdict(datetime.timedelta)
         for act in self.activities:
             day_sum[act.day] += act.duration
@@ -123,6 +380,12 @@ class Work(object):
         :param day: datetime
         :return: dict with keys: start dates of a week, values: timedelta
         '''
+        if self.store is not None:
+            return defaultdict(datetime.timedelta, self.store.hours_per_week(**self.filters))
+        if self.cube is not None:
+            return defaultdict(datetime.timedelta, self.cube.hours_per_week(**self.filters))
+        if self.timezones is not None:
+            return defaultdict(datetime.timedelta, self.group_by('week'))
         week_sum = defaultdict(datetime.timedelta)
         # special_date = datetime.date(day=29, month=7, year=2019)
         for act in self.activities:
@@ -143,14 +406,23 @@ class Work(object):
         :return: list of dates between start_date and end_date with less than hour_threshold work, possible with
         weekends excluded
         """
-        holidays = []
-        day_sum = self.hours_per_day()
-        day = start_date
-        while day <= end_date:  # loop over all days from start_date to end_date
-            if (not day in day_sum.keys()) or (day in day_sum.keys() and day_sum[day] <= hour_threshold):
-                if not (exclude_weekend and (weekday(day) == 6 or weekday(day) == 7)):
-                    holidays.append(day)
-            day = day + datetime.timedelta(days=1)
+        if self.store is not None:
+            from activity_store import _holidays
+
+            filters = self._store_filters(start_date, end_date)
+            worked = set(self.store.worked_days(hour_threshold, **filters))
+            holidays = _holidays(start_date, end_date, worked, exclude_weekend)
+            if verbose:
+                day_sum = defaultdict(datetime.timedelta, self.store.hours_per_day(**filters))
+        else:
+            holidays = []
+            day_sum = self.hours_per_day()
+            day = start_date
+            while day <= end_date:  # loop over all days from start_date to end_date
+                if (not day in day_sum.keys()) or (day in day_sum.keys() and day_sum[day] <= hour_threshold):
+                    if not (exclude_weekend and (weekday(day) == 6 or weekday(day) == 7)):
+                        holidays.append(day)
+                day = day + datetime.timedelta(days=1)
 
         if verbose:
             print('days with less than {} between {} and {}, '.format(hour_threshold, start_date, end_date))
@@ -196,17 +468,9 @@ class Work(object):
         :param end_date:
         :return:
         """
-        week_sum = self.hours_per_week()
+        _, week_list, hour_list = self.week_matrix(start_date, end_date)
         fig, ax = plt.subplots(figsize=(8.42, 5.95))
 
-        week_list = []
-        hour_list = []
-        current_week = week_start(start_date)
-        while current_week <= end_date:
-            week_list.append(weeknr(current_week))
-            hour_list.append(week_sum[current_week].days*24 + week_sum[current_week].seconds/3600)
-            current_week += datetime.timedelta(days=7)
-
         # Example data
         # people = ('Tom', 'Dick', 'Harry', 'Slim', 'Jim')
         y_pos = np.arange(len(week_list))
@@ -239,26 +503,11 @@ class Work(object):
         :param end_date:
         :return:
         """
-        day_sum = self.hours_per_day()
+        # a 2-dimensional nparray with 7 columns and a row corresponding to one week
+        # containing the number of hours worked per day in every column, and the week numbers (for y-axis labels)
+        data, week_labels, _ = self.week_matrix(start_date, end_date)
         fig, ax = plt.subplots(figsize=(8.42, 5.95))
 
-        week_labels = [] # contains week numbers (for y-axis labels)
-        hour_list = []
-        # we want to create a 2-dimensional nparray with 7 columns and a row corresponding to one week
-        # containing the number of hours worked per day in every column
-
-        current_week = week_start(start_date)
-        while current_week <= end_date:
-            week_labels.append(weeknr(current_week))
-            day_hours = []
-            for day_offset in range(7):
-                hours = day_sum[current_week + datetime.timedelta(days=day_offset)]
-                day_hours.append(hours.days*24 + hours.seconds/3600)
-
-            hour_list.append(day_hours)
-            current_week += datetime.timedelta(days=7)
-
-        data = np.array(hour_list)
         data_cum = data.cumsum(axis=1)
 
         category_colors = plt.get_cmap('RdYlGn')(
@@ -303,26 +552,11 @@ class Work(object):
         :param end_date:
         :return:
         """
-        day_sum = self.hours_per_day()
+        # a 2-dimensional nparray with 7 columns and a row corresponding to one week
+        # containing the number of hours worked per day in every column, and the week numbers (for y-axis labels)
+        data, week_labels, _ = self.week_matrix(start_date, end_date)
         fig, ax = plt.subplots(figsize=(8.42, 5.95))
 
-        week_labels = [] # contains week numbers (for y-axis labels)
-        hour_list = []
-        # we want to create a 2-dimensional nparray with 7 columns and a row corresponding to one week
-        # containing the number of hours worked per day in every column
-
-        current_week = week_start(start_date)
-        while current_week <= end_date:
-            week_labels.append(weeknr(current_week))
-            day_hours = []
-            for day_offset in range(7):
-                hours = day_sum[current_week + datetime.timedelta(days=day_offset)]
-                day_hours.append(hours.days*24 + hours.seconds/3600)
-
-            hour_list.append(day_hours)
-            current_week += datetime.timedelta(days=7)
-
-        data = np.array(hour_list)
         data_cum = data.cumsum(axis=1)
 
         category_colors = plt.get_cmap('RdYlGn')(
@@ -359,23 +593,33 @@ class Work(object):
         return True
 
 
-    def plot_tags_pie(self, year: int):
+    def hours_per_tag(self, year: int) -> Dict[str, datetime.timedelta]:
         """
-        Plots a pie chart of total time spent per tag for the given year.
+        computes the total time spent per tag in the given year
+        :param year: int
+        :return: dict with keys: tags, values: timedelta
         """
+        if self.store is not None:
+            filters = self._store_filters(datetime.date(year, 1, 1), datetime.date(year, 12, 31))
+            return self.store.hours_per_tag(**filters)
+        if self.cube is not None and all(self.filters[key] is None for key in ('project', 'start_date', 'end_date')):
+            # the tag cells have no project, other filters are applied to the activities
+            return collections.defaultdict(datetime.timedelta, self.cube.hours_per_tag(year, self.filters['user']))
+        if self.timezones is not None:
+            return collections.defaultdict(datetime.timedelta, {
+                tag: td for (tag_year, tag), td in self.group_by('year', 'tag').items() if tag_year == year})
         tag_sums = collections.defaultdict(datetime.timedelta)
         for act in self.activities:
             if act.day.year == year:
-                tags = act.__dict__.get('tags') or act.__dict__.get('Tags') or act.__dict__.get('Tag')
-                # If tags are not already parsed, try to get from row
-                if not tags and hasattr(act, 'row'):
-                    tags = act.row.get('Project Code', '')
-                if not tags:
-                    continue
-                # Assume tags are comma-separated
-                for tag in [t.strip() for t in tags.split(',') if t.strip()]:
+                for tag in act.tag_list():
                     tag_sums[tag] += act.duration
+        return tag_sums
 
+    def plot_tags_pie(self, year: int):
+        """
+        Plots a pie chart of total time spent per tag for the given year.
+        """
+        tag_sums = self.hours_per_tag(year)
         if not tag_sums:
             print(f"No tag data found for year {year}.")
             return
@@ -390,13 +634,15 @@ class Work(object):
         return True
 
 
-def compute_week_sums():
+def compute_week_sums(filename: str = 'data/tmetric.csv') -> Dict[datetime.date, datetime.timedelta]:
+    """
+    prints and returns the work hours per week, only reading the Day and Duration columns
+    :param filename: name of csv file with tmetric data
+    :return: dict with keys: start dates of a week, values: timedelta
+    """
     week_sum = defaultdict(datetime.timedelta)
-    for row in tmetric:
-        td = parse(row['Duration'])
-        duration = datetime.timedelta(hours=td.hour, minutes=td.minute)
-        print(row['Duration'], duration)
-        week_sum[row['Week']] += duration
+    for day, duration in day_totals(filename).items():
+        week_sum[week_start(day)] += duration
 
     for week, dura in week_sum.items():
         hours = int(dura.total_seconds()/3600)
@@ -405,18 +651,18 @@ def compute_week_sums():
     return week_sum
 
 
-def compute_day_sums():
-    day_sum = defaultdict(datetime.timedelta)
-    for row in tmetric:
-        td = parse(row['Duration'])
-        duration = datetime.timedelta(hours=td.hour, minutes=td.minute)
-        day = parse(row['Day'], dayfirst=True)
-        day_sum[day] += duration
+def compute_day_sums(filename: str = 'data/tmetric.csv') -> Dict[datetime.date, datetime.timedelta]:
+    """
+    prints and returns the work hours per day, only reading the Day and Duration columns
+    :param filename: name of csv file with tmetric data
+    :return: dict with keys: dates, values: timedelta
+    """
+    day_sum = day_totals(filename)
 
     for day, dura in day_sum.items():
         hours = int(dura.total_seconds()/3600)
         minutes = int(dura.total_seconds()/60) - 60*hours
-        print('day: {}, hours: {}:{}'.format(day.date(), hours, minutes))
+        print('day: {}, hours: {}:{}'.format(day, hours, minutes))
     return day_sum
 
 
@@ -468,7 +714,8 @@ def plot_test():
 
 def main():
     filename = 'data/tmetric.csv'
-    worktime = Work(filename)
+    # the reports below only need the totals of the rollup cube
+    worktime = Work.from_cube(filename)
     start_date = datetime.date(day=27, month=8, year=2018)
     end_date = datetime.date(day=1, month=9, year=2019)
     weekends = worktime.weekends(start_date, end_date, verbose=True)
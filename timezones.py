@@ -0,0 +1,211 @@
+import datetime
+import json
+import os
+import sys
+import time
+from functools import lru_cache
+from typing import Dict, Tuple
+
+import numpy as np
+from zoneinfo import ZoneInfo
+
+from periods import EPOCH_ORDINAL
+
+
+DAY = 24 * 3600
+UTC = 'UTC'
+CONFIG_FILE = 'data/timezones.json'
+
+
+class TimezoneConfig(object):
+    '''
+    the timezone in which the Start Times of every user (or file) are written, and the zone to report in.
+    The zone of an entry is the zone of its user, else of its file, else the default. Entries without a zone are
+    taken to be in the reporting zone already, i.e. they are not converted
+    '''
+    def __init__(self, report: str = UTC, default: str = None, users: Dict[str, str] = None,
+                 files: Dict[str, str] = None) -> None:
+        """
+        :param report: zone to which all entries are converted (IANA name, e.g. 'Europe/Amsterdam')
+        :param default: zone of entries whose user and file have none
+        :param users: user -> zone
+        :param files: filename -> zone
+        """
+        self.report = report
+        self.default = default
+        self.users = dict(users or {})
+        self.files = dict(files or {})
+        for zone in [report, default] + list(self.users.values()) + list(self.files.values()):
+            if zone is not None:
+                ZoneInfo(zone)  # raises for unknown zones
+
+    @classmethod
+    def load(cls, path: str = CONFIG_FILE) -> 'TimezoneConfig':
+        """
+        reads a JSON file like {"report": "UTC", "default": "Europe/Amsterdam", "users": {"bob": "America/New_York"},
+        "files": {"data/tmetric_ny.csv": "America/New_York"}}
+        """
+        with open(path, encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def configured(cls, path: str = CONFIG_FILE) -> 'TimezoneConfig':
+        """
+        loads path if it exists, else returns None (the entries are then used as written, without conversion)
+        """
+        return cls.load(path) if os.path.exists(path) else None
+
+    def zone(self, user: str = None, filename: str = None) -> str:
+        zone = self.users.get(user) or self.files.get(filename) or self.default
+        return zone or self.report
+
+
+@lru_cache(maxsize=None)
+def transitions(zone: str, first_year: int, last_year: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    finds the UTC offset changes (DST and others) of a zone, computed once per zone and range of years
+    :return: tuple (transition times in UTC seconds since 1970, offsets in seconds), offsets[i] applies before
+    transition i and offsets[-1] after the last one
+    """
+    tz = ZoneInfo(zone)
+
+    def offset(utc_seconds):
+        moment = datetime.datetime.fromtimestamp(utc_seconds, datetime.timezone.utc)
+        return int(moment.astimezone(tz).utcoffset().total_seconds())
+
+    start = int(datetime.datetime(first_year, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+    end = int(datetime.datetime(last_year + 1, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+    times, offsets = [], [offset(start)]
+    # offsets change at most once a day: sample every day, then bisect the change to the second
+    for day in range(start, end, DAY):
+        if offset(day + DAY) != offsets[-1]:
+            low, high = day, day + DAY
+            while high - low > 1:
+                middle = (low + high) // 2
+                if offset(middle) == offsets[-1]:
+                    low = middle
+                else:
+                    high = middle
+            times.append(high)
+            offsets.append(offset(high))
+    return np.array(times, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+def local_to_utc(local: np.ndarray, zone: str) -> np.ndarray:
+    """
+    converts wall clock times of a zone to UTC. Ambiguous times (when the clock is set back) are taken before the
+    change and times skipped when the clock is set forward with the offset before the change, as zoneinfo does (fold=0)
+    :param local: wall clock times as seconds since 1970-01-01 00:00
+    :return: UTC seconds since 1970
+    """
+    if not len(local):
+        return local
+    times, offsets = _table(local, zone)
+    # the wall clock time at which transition i takes effect for fold=0
+    switch = times + np.maximum(offsets[:-1], offsets[1:])
+    return local - offsets[np.searchsorted(switch, local, side='right')]
+
+
+def utc_to_local(utc: np.ndarray, zone: str) -> np.ndarray:
+    """
+    converts UTC seconds since 1970 to wall clock times of a zone (as seconds since 1970-01-01 00:00)
+    """
+    if not len(utc):
+        return utc
+    times, offsets = _table(utc, zone)
+    return utc + offsets[np.searchsorted(times, utc, side='right')]
+
+
+def _table(seconds: np.ndarray, zone: str):
+    # a year of margin on both sides covers the shift between local and UTC times
+    first = datetime.date.fromordinal(int(seconds.min() // DAY) + EPOCH_ORDINAL)
+    last = datetime.date.fromordinal(int(seconds.max() // DAY) + EPOCH_ORDINAL)
+    return transitions(zone, first.year - 1, last.year + 1)
+
+
+def normalize(day: np.ndarray, start: np.ndarray, duration: np.ndarray, zones: np.ndarray, report: str = UTC):
+    """
+    converts entries given in local time to the reporting zone and splits entries that cross midnight there
+    :param day: day ordinals (local)
+    :param start: start times in seconds since local midnight
+    :param duration: durations in seconds
+    :param zones: zone name of every entry (np.ndarray of str or object)
+    :param report: reporting zone
+    :return: tuple of arrays with one element per part of an entry: day ordinals and start times (reporting zone),
+    durations, index of the entry
+    """
+    local = (np.asarray(day, dtype=np.int64) - EPOCH_ORDINAL) * DAY + np.asarray(start, dtype=np.int64)
+    duration = np.asarray(duration, dtype=np.int64)
+    begin = local.copy()
+    names, zone_index = np.unique(np.asarray(zones, dtype=object).astype(str), return_inverse=True)
+    for i, zone in enumerate(names):
+        if zone != report:
+            mask = zone_index == i
+            begin[mask] = utc_to_local(local_to_utc(local[mask], zone), report)
+
+    # split at midnight: an entry covers days first_day..last_day
+    end = begin + duration
+    first_day = begin // DAY
+    last_day = np.maximum(end - 1, begin) // DAY
+    parts = last_day - first_day + 1
+    index = np.repeat(np.arange(len(begin)), parts)
+    part_day = first_day[index] + np.arange(len(index)) - np.repeat(np.cumsum(parts) - parts, parts)
+    part_begin = np.maximum(begin[index], part_day * DAY)
+    part_end = np.minimum(end[index], (part_day + 1) * DAY)
+    return part_day + EPOCH_ORDINAL, part_begin - part_day * DAY, part_end - part_begin, index
+
+
+def synthetic_export(n: int, users: Dict[str, str], seed: int = 0):
+    """
+    random entries of the given users (user -> zone) over five years, as arrays like normalize takes
+    """
+    rng = np.random.default_rng(seed)
+    first = datetime.date(2019, 1, 1).toordinal()
+    user_index = rng.integers(0, len(users), n)
+    user = np.array(list(users), dtype=object)[user_index]
+    zones = np.array(list(users.values()), dtype=object)[user_index]
+    day = rng.integers(first, first + 5 * 365, n)
+    start = rng.integers(0, DAY // 60, n) * 60
+    duration = rng.integers(1, 10 * 60, n) * 60
+    return user, day, start, duration, zones
+
+
+def benchmark(n: int = 2000000, report: str = UTC) -> dict:
+    """
+    normalizes a synthetic export of n entries and compares a sample with per-row zoneinfo conversions
+    :return: dict with entries per second (vectorized and per row) and the number of mismatches in the sample
+    """
+    users = {'alice': 'Europe/Amsterdam', 'bob': 'America/New_York', 'carol': 'Asia/Kolkata',
+             'dave': 'Australia/Sydney', 'erin': UTC}
+    user, day, start, duration, zones = synthetic_export(n, users)
+    started = time.perf_counter()
+    part_day, part_start, part_duration, index = normalize(day, start, duration, zones, report)
+    vectorized = n / (time.perf_counter() - started)
+
+    sample = np.arange(0, n, max(n // 20000, 1))
+    report_tz = ZoneInfo(report)
+    started = time.perf_counter()
+    expected = []
+    for i in sample:
+        local = datetime.datetime.combine(datetime.date.fromordinal(int(day[i])), datetime.time()) + \
+            datetime.timedelta(seconds=int(start[i]))
+        expected.append(local.replace(tzinfo=ZoneInfo(zones[i])).astimezone(report_tz).replace(tzinfo=None))
+    per_row = len(sample) / (time.perf_counter() - started)
+
+    first_part = np.searchsorted(index, sample)
+    mismatches = sum(
+        1 for j, moment in zip(first_part, expected)
+        if (moment.toordinal(), moment.hour * 3600 + moment.minute * 60 + moment.second) !=
+        (part_day[j], part_start[j]))
+    return {'entries': n, 'parts': len(index), 'entries/s': vectorized, 'per row entries/s': per_row,
+            'mismatches': mismatches, 'duration preserved': int(part_duration.sum()) == int(duration.sum())}
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    for key, value in benchmark(n).items():
+        print('{}: {}'.format(key, round(value) if isinstance(value, float) else value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+import bz2
+import csv
+import datetime
+import gzip
+import io
+import lzma
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, List, Tuple
+
+from dateutil.parser import parse
+
+
+# archived exports are read (and processed output can be written) compressed, chosen by the file extension
+COMPRESSORS = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}
+BUFFER_SIZE = 1 << 20  # bytes per read from disk
+
+
+def compression(filename: str) -> str:
+    """
+    returns the compression suffix of filename ('.gz', '.bz2' or '.xz'), or '' for uncompressed files
+    """
+    suffix = os.path.splitext(filename)[1].lower()
+    return suffix if suffix in COMPRESSORS else ''
+
+
+def strip_compression(filename: str) -> str:
+    """
+    returns filename without its compression suffix, e.g. data/tmetric.csv for data/tmetric.csv.gz
+    """
+    suffix = compression(filename)
+    return filename[:-len(suffix)] if suffix else filename
+
+
+def open_text(filename: str, mode: str = 'r', encoding: str = 'utf-8-sig'):
+    """
+    opens a (compressed) CSV file as text for the csv module, compressed files are decompressed while reading
+    :param filename: name of the file, ending with .gz, .bz2 or .xz for compressed files
+    :param mode: 'r' or 'w'
+    :param encoding: text encoding
+    :return: text file object (with newline='')
+    """
+    module = COMPRESSORS.get(compression(filename))
+    if module is None:
+        return open(filename, mode, newline='', encoding=encoding, buffering=BUFFER_SIZE)
+    binary = module.open(filename, mode + 'b')
+    if mode == 'r':
+        binary = io.BufferedReader(binary, BUFFER_SIZE)
+    else:
+        binary = io.BufferedWriter(binary, BUFFER_SIZE)
+    return io.TextIOWrapper(binary, encoding=encoding, newline='')
+
+
+# TMetric exports repeat the same handful of day, clock and duration strings over and over,
+# so the (slow) dateutil parse is done once per distinct string and cached
+
+@lru_cache(maxsize=None)
+def parse_day(text: str, dayfirst: bool = True, yearfirst: bool = False) -> datetime.date:
+    """
+    parses the Day column of a tmetric row
+    :param text: day as written in the CSV file
+    :param dayfirst: passed on to dateutil
+    :param yearfirst: passed on to dateutil
+    :return: datetime.date
+    """
+    return parse(text, dayfirst=dayfirst, yearfirst=yearfirst).date()
+
+
+# how the email adjusted pipeline (process_tmetric_email_adjusted) parses Day, Activity uses the defaults of parse_day
+PIPELINE_DAYFIRST = False
+PIPELINE_YEARFIRST = True
+
+
+@lru_cache(maxsize=None)
+def parse_clock(text: str) -> int:
+    """
+    parses a Start Time or End Time value
+    :param text: time of day, e.g. "09:15"
+    :return: number of seconds since midnight
+    """
+    t = parse(text)
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+@lru_cache(maxsize=None)
+def parse_duration(text: str) -> int:
+    """
+    parses a Duration value, only hours and minutes are taken into account (like Activity does)
+    :param text: duration, e.g. "1:30"
+    :return: number of seconds
+    """
+    t = parse(text)
+    return t.hour * 3600 + t.minute * 60
+
+
+def row_tags(row: dict) -> list:
+    """
+    returns the tags (Work Type) of a tmetric row, falling back to the project code if there are none
+    :param row: CSV row of tmetric data
+    :return: list of stripped, non-empty tags
+    """
+    tags = row.get('Work Type') or row.get('Project Code', '')
+    if not tags:
+        return []
+    return [t.strip() for t in tags.split(',') if t.strip()]
+
+
+def read_columns(filename: str, columns: List[str], encoding: str = 'utf-8-sig'):
+    """
+    reads only the given columns of a CSV file, without building a dict per row
+    :param filename: name of csv file (may be compressed, see open_text)
+    :param columns: names of the columns, their indices are looked up once in the header
+    :return: generator of tuples of strings, in the order of columns
+    """
+    with open_text(filename, encoding=encoding) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise KeyError('columns {} not in {}'.format(', '.join(missing), filename))
+        index = [header.index(c) for c in columns]
+        getter = itemgetter(*index)
+        width = max(index) + 1
+        single = len(index) == 1
+        for values in reader:
+            if len(values) < width:
+                if not values:
+                    continue  # blank line, skipped like csv.DictReader does
+                values += [''] * (width - len(values))  # short record, padded like mmap_columns does
+            yield (getter(values),) if single else getter(values)
+
+
+def csv_header(filename: str, encoding: str = 'utf-8-sig') -> List[str]:
+    """
+    returns the column names of a (compressed) CSV file
+    """
+    with open_text(filename, encoding=encoding) as csvfile:
+        return next(csv.reader(csvfile), [])
+
+
+def _mmap(filename: str):
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _header(data, encoding: str) -> Tuple[List[str], int, bytes]:
+    """
+    :return: tuple (column names, offset of the first record, record separator)
+    """
+    end = data.find(b'\n')
+    end = len(data) if end == -1 else end + 1
+    line = bytes(data[:end])
+    separator = b'\r\n' if line.endswith(b'\r\n') else b'\n'
+    return next(csv.reader([line.decode(encoding)]), []), end, separator
+
+
+def split_chunks(filename: str, n: int) -> List[Tuple[int, int]]:
+    """
+    splits the records of an uncompressed CSV file into about n byte ranges of similar size for parallel workers.
+    Every range starts after a newline that is not inside a quoted field, so it holds whole records only
+    :param filename: name of csv file
+    :param n: number of chunks
+    :return: list of (start, end) byte offsets, to be passed on to mmap_columns
+    """
+    if compression(filename):
+        raise ValueError('cannot split compressed file {}'.format(filename))
+    data = _mmap(filename)
+    try:
+        _, start, _ = _header(data, 'utf-8-sig')
+        size = len(data)
+        bounds = [start]
+        quotes = 0  # number of quote characters before bounds[-1]
+        for i in range(1, n):
+            target = max(start + (size - start) * i // n, bounds[-1])
+            end = data.find(b'\n', target)
+            while end != -1:
+                # a newline ends a record if the number of quotes before it is even
+                block_quotes = quotes + data[bounds[-1]:end].count(b'"')
+                if block_quotes % 2 == 0:
+                    break
+                end = data.find(b'\n', end + 1)
+            if end == -1 or end + 1 >= size:
+                break
+            quotes = block_quotes
+            bounds.append(end + 1)
+        bounds.append(size)
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def _records(data, start: int, end: int, separator: bytes, index: List[int], encoding: str,
+             block_size: int = 16 * BUFFER_SIZE):
+    """
+    splits data[start:end] into records and yields the fields at index as tuples of strings. The bytes are decoded
+    in newline aligned blocks, plain records are split at the commas and only records with quotes (fields with
+    commas or newlines) are parsed by the csv module
+    """
+    getter = itemgetter(*index)
+    width = max(index) + 1
+    single = len(index) == 1
+    separator = separator.decode()
+
+    def fields_of(record: str):
+        fields = next(csv.reader([record]), []) if '"' in record else record.split(',')
+        if len(fields) < width:
+            fields += [''] * (width - len(fields))
+        return (getter(fields),) if single else getter(fields)
+
+    pending = None  # lines of a record with a quoted newline
+    rest = ''  # text after the last separator of the previous block
+    pos = start
+    while pos < end:
+        # decoding per line is slower than decoding a whole block: str.split and itemgetter then do all the work
+        block_end = data.find(b'\n', min(pos + block_size, end) - 1, end)
+        block_end = end if block_end == -1 else block_end + 1
+        lines = (rest + data[pos:block_end].decode(encoding)).split(separator)
+        pos = block_end
+        rest = lines.pop() if pos < end else ''
+        for line in lines:
+            if pending is not None:
+                pending.append(line)
+                record = separator.join(pending)
+                if record.count('"') % 2 == 0:
+                    pending = None
+                    yield fields_of(record)
+            elif '"' in line and line.count('"') % 2:
+                pending = [line]
+            elif line:
+                yield fields_of(line)
+    if pending is not None:
+        yield fields_of(separator.join(pending))
+
+
+def mmap_columns(filename: str, columns: List[str], start: int = None, end: int = None,
+                 encoding: str = 'utf-8-sig'):
+    """
+    reads only the given columns of a CSV file like read_columns, but memory-maps the file and splits the records
+    itself, see _records, so it can read any byte range of the file (see split_chunks). Compressed files are read
+    with read_columns
+    :param filename: name of csv file
+    :param columns: names of the columns
+    :param start: byte offset of the first record to read, e.g. from split_chunks (default: after the header)
+    :param end: byte offset after the last record to read (default: end of file)
+    :return: generator of tuples of strings, in the order of columns
+    """
+    if compression(filename):
+        yield from read_columns(filename, columns, encoding)
+        return
+    data = _mmap(filename)
+    try:
+        header, first, separator = _header(data, encoding)
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise KeyError('columns {} not in {}'.format(', '.join(missing), filename))
+        field_encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding  # the BOM is only at the file start
+        yield from _records(data, first if start is None else start, len(data) if end is None else end,
+                            separator, [header.index(c) for c in columns], field_encoding)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def day_totals(filename: str, day_column: str = 'Day', duration_column: str = 'Duration',
+               dayfirst: bool = True, yearfirst: bool = False) -> Dict[datetime.date, datetime.timedelta]:
+    """
+    sums the durations per day, reading only the Day and Duration columns
+    :param filename: name of csv file with tmetric data
+    :return: dict with keys: dates, values: timedelta
+    """
+    # count equal (day, duration) strings first, then parse every distinct pair once
+    pairs = Counter(read_columns(filename, [day_column, duration_column]))
+    seconds = defaultdict(int)
+    for (day, duration), n in pairs.items():
+        if not day or not duration:
+            continue  # short record
+        seconds[parse_day(day, dayfirst, yearfirst)] += n * parse_duration(duration)
+    return {day: datetime.timedelta(seconds=s) for day, s in sorted(seconds.items())}
+
+
+@lru_cache(maxsize=None)
+def calendar_day(text: str) -> datetime.date:
+    """
+    parses the day of a processed file: parsed_day is ISO, Day (of files without parsed_day) day first
+    :return: datetime.date, None if text is neither
+    """
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+def day_hours(filename: str, year: int = None, day_column: str = None,
+              hours_column: str = 'Duration adjusted (hours)', timezones=None,
+              by_user: bool = False) -> Dict[datetime.date, float]:
+    """
+    sums the (email adjusted) hours per day of a processed file, reading only those two columns
+    (and User, Start Time and Duration if needed)
+    :param filename: name of a csv file written by process_tmetric_email_adjusted
+    :param year: only this year (default: all years)
+    :param day_column: default parsed_day, or Day if the file has no parsed_day
+    :param timezones: timezones.TimezoneConfig, if given the hours are moved to the days of its reporting zone,
+    split over both days (proportionally to the duration) where an entry crosses midnight there
+    :param by_user: key the hours by (user, date) instead of date
+    :return: dict with keys: dates (or (user, date) tuples), values: hours
+    """
+    if day_column is None:
+        day_column = 'parsed_day' if 'parsed_day' in csv_header(filename, encoding='utf-8') else 'Day'
+    columns = [day_column, hours_column]
+    if by_user or timezones is not None:
+        columns.append('User')
+    if timezones is not None:
+        columns += ['Start Time', 'Duration']
+    entries = []  # (date, hours, user[, start, duration])
+    for values in read_columns(filename, columns, encoding='utf-8'):
+        date = calendar_day(values[0]) if values[0] else None
+        if date is not None:
+            entries.append((date, float(values[1]) if values[1] else 0.0, *(values[2:] or ('',))))
+    if timezones is not None:
+        entries = _in_zone(entries, timezones, filename)
+
+    hours = defaultdict(float)
+    for date, value, user, *_ in entries:
+        if year is None or date.year == year:
+            hours[(user, date) if by_user else date] += value
+    return hours
+
+
+def _in_zone(entries: list, timezones, filename: str) -> list:
+    # moves (date, hours, user, start, duration) entries to the reporting zone, see timezones.normalize
+    from timezones import normalize
+
+    if not entries:
+        return entries
+    dates, hours, users, starts, durations = zip(*entries)
+    duration = [parse_duration(text) if text else 0 for text in durations]
+    zone_of = {user: timezones.zone(user, filename) for user in set(users)}
+    part_day, _, part_duration, index = normalize(
+        [date.toordinal() for date in dates], [parse_clock(text) if text else 0 for text in starts], duration,
+        [zone_of[user] for user in users], timezones.report)
+    return [(datetime.date.fromordinal(day), hours[i] * part / duration[i] if duration[i] else hours[i], users[i])
+            for day, part, i in zip(part_day.tolist(), part_duration.tolist(), index.tolist())]
+
+
+def compression_benchmark(filename: str, disk_mb_per_s: float = 50.0) -> List[dict]:
+    """
+    compares reading filename uncompressed and as .gz, .bz2 and .xz copies (written to a temporary directory)
+    :param filename: name of an uncompressed csv file with tmetric data
+    :param disk_mb_per_s: read speed of the slow disk, used to estimate the time spent waiting for I/O
+    :return: list of dicts with the file size (bytes read), the wall time of day_totals and the estimated time on a
+    disk with the given speed (wall time + bytes / speed)
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for suffix in [''] + list(COMPRESSORS):
+            path = os.path.join(directory, os.path.basename(filename) + suffix)
+            with open(filename, 'rb') as source, (COMPRESSORS[suffix].open(path, 'wb') if suffix
+                                                  else open(path, 'wb')) as target:
+                shutil.copyfileobj(source, target, BUFFER_SIZE)
+            parse_day.cache_clear()
+            parse_duration.cache_clear()
+            start = time.perf_counter()
+            day_totals(path)
+            wall = time.perf_counter() - start
+            size = os.path.getsize(path)
+            results.append({'file': os.path.basename(path), 'bytes': size, 'wall s': wall,
+                            'slow disk s': wall + size / (disk_mb_per_s * 1e6)})
+    return results
+
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'data/tmetric.csv'
+    for result in compression_benchmark(filename):
+        print('{file:30} {bytes:>12,} bytes  {wall s:6.2f}s  {slow disk s:6.2f}s at 50 MB/s'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
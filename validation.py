@@ -0,0 +1,140 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from tmetric_io import parse_day, parse_clock, parse_duration
+
+
+# status bits of a row
+OK = 0
+DURATION_MISMATCH = 1   # End Time - Start Time (modulo a day) differs from Duration
+CROSSES_MIDNIGHT = 2    # End Time before Start Time, or Start Time + Duration after midnight
+NOT_POSITIVE = 4        # Duration is zero (or negative)
+DUPLICATE = 8           # same user, day, start time, duration, project and entry as an earlier row (the key of
+                        # activity_store, which stores such a row once)
+UNPARSABLE = 16         # Day, Start Time, End Time or Duration missing or not readable
+
+ISSUES = {
+    DURATION_MISMATCH: 'duration mismatch',
+    CROSSES_MIDNIGHT: 'crosses midnight',
+    NOT_POSITIVE: 'duration not positive',
+    DUPLICATE: 'duplicate',
+    UNPARSABLE: 'unparsable',
+}
+
+POLICIES = ('fix', 'drop', 'fail')
+
+
+class ValidationReport(object):
+    '''
+    result of validate_rows: status holds the status bits of every row, see ISSUES. parsed holds the parsed values
+    of the remaining rows ('day': day ordinals, 'start' and 'duration': seconds), so they need not be parsed again
+    '''
+    def __init__(self, status: np.ndarray, policy: str, parsed: dict = None) -> None:
+        self.status = status
+        self.policy = policy
+        self.parsed = parsed or {}
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    @property
+    def ok(self) -> np.ndarray:
+        return self.status == OK
+
+    def rows_with(self, issue: int) -> np.ndarray:
+        """
+        returns the indices of the rows with the given issue
+        """
+        return np.flatnonzero(self.status & issue)
+
+    def counts(self) -> dict:
+        return {name: int(np.count_nonzero(self.status & issue)) for issue, name in ISSUES.items()}
+
+    def __str__(self) -> str:
+        counts = ', '.join('{}: {}'.format(name, n) for name, n in self.counts().items() if n)
+        return '{} rows, {} with issues ({}), policy: {}'.format(
+            len(self), int(np.count_nonzero(self.status)), counts or 'none', self.policy)
+
+
+def _codes(values: List[str]) -> np.ndarray:
+    index = {}
+    return np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int64, count=len(values))
+
+
+def _parse_column(rows: List[dict], column: str, parser) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    parses one column of all rows, rows whose value cannot be parsed get 0
+    :return: tuple (values, mask of the rows that could not be parsed)
+    """
+    values = np.zeros(len(rows), dtype=np.int64)
+    failed = np.zeros(len(rows), dtype=bool)
+    for i, row in enumerate(rows):
+        try:
+            values[i] = parser(row[column])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            failed[i] = True
+    return values, failed
+
+
+def check_columns(day: np.ndarray, start: np.ndarray, end: np.ndarray, duration: np.ndarray,
+                  keys: np.ndarray = None) -> np.ndarray:
+    """
+    runs all checks on parsed columns
+    :param day: day ordinals
+    :param start: start times in seconds since midnight
+    :param end: end times in seconds since midnight
+    :param duration: durations in seconds
+    :param keys: optional 2-dimensional array with one row of integer codes per activity for the duplicate check
+    :return: status bits per row
+    """
+    status = np.zeros(len(day), dtype=np.int8)
+    # an entry from 23:00 to 01:00 lasting 2:00 is consistent, it only crosses midnight
+    status[(end - start) % (24 * 3600) != duration] |= DURATION_MISMATCH
+    status[(end < start) | (start + duration > 24 * 3600)] |= CROSSES_MIDNIGHT
+    status[duration <= 0] |= NOT_POSITIVE
+    if keys is None:
+        keys = np.column_stack([day, start, end, duration])
+    if len(keys):
+        _, first = np.unique(keys, axis=0, return_index=True)
+        duplicate = np.ones(len(keys), dtype=bool)
+        duplicate[first] = False
+        status[duplicate] |= DUPLICATE
+    return status
+
+
+def validate_rows(rows: List[dict], policy: str = 'fix') -> Tuple[List[dict], ValidationReport]:
+    """
+    checks tmetric rows for duration mismatches, entries crossing midnight, durations that are not positive,
+    duplicates and values that cannot be parsed, and applies the policy:
+    fix: keep the rows, Activity takes Start Time + Duration as end time (as before). Duplicates are removed (the
+    first occurrence is kept), as are rows whose Day, Start Time or Duration cannot be parsed
+    drop: remove all rows with an issue
+    fail: raise ValueError if any row has an issue
+    :param rows: list of CSV rows of tmetric data
+    :param policy: one of POLICIES
+    :return: tuple (remaining rows, report)
+    """
+    if policy not in POLICIES:
+        raise ValueError('unknown policy {!r}, use one of {}'.format(policy, ', '.join(POLICIES)))
+    day, bad_day = _parse_column(rows, 'Day', lambda text: parse_day(text).toordinal())
+    start, bad_start = _parse_column(rows, 'Start Time', parse_clock)
+    end, bad_end = _parse_column(rows, 'End Time', parse_clock)
+    duration, bad_duration = _parse_column(rows, 'Duration', parse_duration)
+    keys = np.column_stack([day, start, duration,
+                            _codes([row.get('User', '') for row in rows]),
+                            _codes([row.get('Project', '') for row in rows]),
+                            _codes([row.get('Time Entry', '') for row in rows])])
+    status = check_columns(day, start, end, duration, keys)
+    # the other checks are meaningless for rows with unparsable values
+    unfixable = bad_day | bad_start | bad_duration
+    status[unfixable | bad_end] = UNPARSABLE
+    if policy == 'fail' and status.any():
+        raise ValueError('invalid tmetric data: {}'.format(ValidationReport(status, policy)))
+    if policy == 'drop':
+        keep = status == OK
+    else:
+        keep = ~unfixable & (status & DUPLICATE == 0)
+    if not keep.all():
+        rows = [row for row, kept in zip(rows, keep) if kept]
+    return rows, ValidationReport(status, policy, {'day': day[keep], 'start': start[keep], 'duration': duration[keep]})